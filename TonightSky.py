@@ -11,29 +11,47 @@ import webbrowser
 import json
 import os
 import platform
-from astropy.coordinates import EarthLocation, AltAz, SkyCoord
+from astropy.coordinates import EarthLocation, AltAz, SkyCoord, TETE
 from astropy.time import Time
 import astropy.units as u
-from astropy.coordinates import get_sun
+from astropy.coordinates import get_sun, get_body
+from astropy.utils import iers
 import threading
+import queue
 import urllib.parse
 import webbrowser
 import re
 import shutil
+import hashlib
+import io
+import zipfile
+import itertools
+import contextlib
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.colors import LinearSegmentedColormap
 from matplotlib.collections import LineCollection
 import matplotlib.dates as mdates 
 import numpy as np
+from h3.api import basic_int as h3
 #from scipy.interpolate import CubicSpline
-from astroplan import Observer, FixedTarget
+from astroplan import moon_illumination
 
 
 # Define files the JSON file is where the sesttings and CSV path will be stored 
 # if not find in app folder
 json_file = 'tonightsky.json'
 csv_filename = 'celestial_catalog.csv'  # The default CSV file name
+result_cache_dirname = 'result_cache'  # Folder in the app data path holding cached search results
+iers_dirname = 'iers'  # Folder in the app data path holding an imported IERS-A table
+twilight_dirname = 'twilight'  # Folder in the app data path holding the yearly twilight table of each site
+
+# Bump this whenever the compute code changes the values or layout of a result row,
+# cached results from older versions are then discarded
+COMPUTE_VERSION = 6
+
+# Minimum altitude (degrees) and hours of astronomical darkness a night needs for the Season columns
+default_season = (30, 2)
 
 def load_settings():
     """Load settings from tonightsky.json, including filters and catalog checkboxes."""
@@ -109,6 +127,608 @@ def get_csv_path():
     shutil.copy(csv_file_path, csv_data_path)
     return csv_data_path
 
+def normalize_text(text):
+    """Lowercase text with runs of whitespace collapsed to one space, 'M     31' becomes 'm 31'."""
+    return ' '.join(text.lower().split())
+
+def trigram_keys(text):
+    """Integer keys of the distinct three character substrings of text."""
+    return {(ord(text[i]) << 42) | (ord(text[i + 1]) << 21) | ord(text[i + 2]) for i in range(len(text) - 2)}
+
+class TrigramIndex:
+    """
+    Inverted trigram index over a table of distinct strings, on their normalize_text form.
+    Every trigram maps to the sorted table indices of the strings containing it, so the strings
+    containing a pattern of three or more characters are found by intersecting the postings of
+    the pattern's trigrams. The intersection is a superset of the matches (the trigrams may occur
+    apart), search verifies the candidates exactly. Postings are held as flat numpy arrays.
+    """
+
+    def __init__(self, strings):
+        self.strings = [normalize_text(value) for value in strings]
+        self.size = len(self.strings)  # Strings in the postings, later ones are added by extend
+        lengths = np.array([len(value) for value in self.strings], dtype=np.int64)
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1])) if len(lengths) else lengths
+
+        # Code points of every string laid end to end, a trigram starts at each position that
+        # is followed by two more characters of the same string
+        points = np.frombuffer(''.join(self.strings).encode('utf-32-le'), dtype=np.uint32).astype(np.int64)
+        owner = np.repeat(np.arange(len(lengths), dtype=np.int32), lengths)
+        valid = np.flatnonzero(np.arange(len(points)) + 2 < np.repeat(starts + lengths, lengths))
+        keys = (points[valid] << 42) | (points[valid + 1] << 21) | points[valid + 2]
+        owner = owner[valid]
+
+        # Distinct (trigram, string) pairs sorted by trigram then string
+        order = np.lexsort((owner, keys))
+        keys, owner = keys[order], owner[order]
+        distinct = np.ones(len(keys), dtype=bool)
+        distinct[1:] = (keys[1:] != keys[:-1]) | (owner[1:] != owner[:-1])
+        keys, self.postings = keys[distinct], owner[distinct]
+
+        first = np.ones(len(keys), dtype=bool)
+        first[1:] = keys[1:] != keys[:-1]
+        self.keys = keys[first]
+        self.offsets = np.append(np.flatnonzero(first), len(keys))
+
+    def candidates(self, pattern):
+        """Sorted table indices of the strings that contain every trigram of pattern, and of any added strings."""
+        added = np.arange(self.size, len(self.strings), dtype=np.int32)
+        postings = []
+        for key in trigram_keys(normalize_text(pattern)):
+            i = np.searchsorted(self.keys, key)
+            if i == len(self.keys) or self.keys[i] != key:
+                return added
+            postings.append(self.postings[self.offsets[i]:self.offsets[i + 1]])
+        if not postings:
+            return np.arange(len(self.strings), dtype=np.int32)  # Patterns shorter than a trigram
+        # Intersect from the rarest trigram up, probing each longer posting by binary search
+        postings.sort(key=len)
+        result = postings[0]
+        for posting in postings[1:]:
+            positions = np.minimum(np.searchsorted(posting, result), len(posting) - 1)
+            result = result[posting[positions] == result]
+        return np.concatenate((result, added))
+
+    def extend(self, strings):
+        """
+        Add the strings appended to the table since the index was built. They are not in the
+        postings, every search verifies them directly until the index is built again.
+        """
+        self.strings.extend(normalize_text(value) for value in strings[len(self.strings):])
+
+    def search(self, pattern, matches=None, limit=None):
+        """
+        Sorted table indices of the strings containing pattern once both are normalized, verifying
+        the candidates in order and stopping after the first limit matches if given.
+        matches(index) replaces that test when verifying the candidates, a substring of a string
+        is always a substring of it after normalizing, so the candidates cover any substring test.
+        """
+        if matches is None:
+            pattern = normalize_text(pattern)
+            matches = lambda code: pattern in self.strings[code]
+        candidates = self.candidates(pattern)
+        blocks = (candidates[start:start + 4096].tolist() for start in range(0, len(candidates), 4096))  # Listed as verified
+        found = (code for block in blocks for code in block if matches(code))
+        return np.fromiter(itertools.islice(found, limit), dtype=np.int32)
+
+# h3 3.x (the pinned version) names, or their h3 4.x equivalents
+h3_latlng_to_cell = getattr(h3, 'latlng_to_cell', None) or h3.geo_to_h3
+h3_grid_disk = getattr(h3, 'grid_disk', None) or h3.k_ring
+H3_EARTH_RADIUS_KM = 6371.007180918475  # Sphere h3 measures its cells on
+H3_RES0_EDGE_KM = 1281.256011  # Average hexagon edge at resolution 0, each resolution divides it by about sqrt(7)
+
+def gather_ranges(order, begins, ends):
+    """Concatenate order[begins[i]:ends[i]] for every i in one array operation."""
+    counts = ends - begins
+    positions = np.repeat(begins - np.concatenate(([0], np.cumsum(counts)[:-1])), counts) + np.arange(counts.sum())
+    return order[positions]
+
+class SkyIndex:
+    """
+    Spatial index of sky positions on h3 cells, the sky taken as a sphere with Dec as latitude
+    and RA as longitude. Every position is assigned its cell at `resolution` (about 0.6 degrees
+    across at 3) and the rows are kept sorted by cell. A cone is covered by the ring of cells
+    within k steps of the cell of its centre, the rows of those cells are the candidates and
+    their exact separations from the centre pick the result.
+    """
+
+    def __init__(self, ra_deg, dec_deg, resolution=3):
+        self.ra = np.asarray(ra_deg, dtype=np.float64)
+        self.dec = np.asarray(dec_deg, dtype=np.float64)
+        self.resolution = resolution
+        valid = np.flatnonzero(np.isfinite(self.ra) & np.isfinite(self.dec))
+        cells = np.array([h3_latlng_to_cell(dec, (ra + 180) % 360 - 180, resolution)
+                          for ra, dec in zip(self.ra[valid].tolist(), self.dec[valid].tolist())], dtype=np.uint64)
+        order = np.argsort(cells, kind='stable')
+        self.cells = cells[order]
+        self.rows = valid[order].astype(np.int32)
+        self.changed = np.empty(0, dtype=np.int32)  # Rows moved, added or removed since the index was built
+
+        # Cells vary in size over the sphere, so distances between cells are taken conservatively
+        # (h3 3.x edge_length reports smaller, outdated averages, so the edge is not taken from the library)
+        edge = np.degrees(H3_RES0_EDGE_KM / np.sqrt(7) ** resolution / H3_EARTH_RADIUS_KM)
+        self.cell_radius = 1.5 * edge                    # Upper bound, centre to farthest point of a cell
+        self.ring_spacing = np.sqrt(3) * edge / 1.5      # Lower bound, distance gained per ring step
+
+    def cone(self, ra_deg, dec_deg, radius_deg):
+        """Rows within radius_deg of a position and their separations in degrees, ordered by separation."""
+        k = int(np.ceil((radius_deg + self.cell_radius) / self.ring_spacing))
+        if k > 20 or 3 * k * (k + 1) > len(self.rows) // 8:
+            candidates = self.rows  # Listing the cells would cost more than testing every row
+        else:
+            disk = np.sort(np.array(list(h3_grid_disk(h3_latlng_to_cell(dec_deg, (ra_deg + 180) % 360 - 180, self.resolution), k)), dtype=np.uint64))
+            candidates = gather_ranges(self.rows, np.searchsorted(self.cells, disk, 'left'), np.searchsorted(self.cells, disk, 'right'))
+        if len(self.changed):
+            # Changed rows may be filed under a stale cell, they are tested wherever they are now
+            candidates = np.concatenate((candidates[~np.isin(candidates, self.changed)], self.changed))
+        separation = angular_separation_deg(self.ra[candidates], self.dec[candidates], ra_deg, dec_deg)
+        inside = separation <= radius_deg
+        order = np.argsort(separation[inside], kind='stable')
+        return candidates[inside][order], separation[inside][order]
+
+    def update(self, ra_deg, dec_deg, rows):
+        """Take the current positions after the given rows were changed, added or removed."""
+        self.ra = np.asarray(ra_deg, dtype=np.float64)
+        self.dec = np.asarray(dec_deg, dtype=np.float64)
+        self.changed = np.union1d(self.changed, rows).astype(np.int32)
+
+    def field(self, ra_deg, dec_deg, width_deg, height_deg, position_angle_deg=0):
+        """
+        Rows inside a camera field of view centred on a position, width by height degrees on the
+        tangent plane with the height rotated position_angle_deg east of north. Returns the rows
+        and their separations from the centre, ordered by separation.
+        """
+        half_diagonal = np.degrees(np.arctan(np.hypot(np.tan(np.radians(width_deg / 2)), np.tan(np.radians(height_deg / 2)))))
+        rows, separation = self.cone(ra_deg, dec_deg, half_diagonal)
+
+        # Gnomonic projection of the candidates onto the plane tangent at the centre
+        ra0, dec0 = np.radians(ra_deg), np.radians(dec_deg)
+        ra, dec = np.radians(self.ra[rows]), np.radians(self.dec[rows])
+        cos_c = np.sin(dec0) * np.sin(dec) + np.cos(dec0) * np.cos(dec) * np.cos(ra - ra0)
+        east = np.cos(dec) * np.sin(ra - ra0) / cos_c
+        north = (np.cos(dec0) * np.sin(dec) - np.sin(dec0) * np.cos(dec) * np.cos(ra - ra0)) / cos_c
+        angle = np.radians(position_angle_deg)
+        across = east * np.cos(angle) - north * np.sin(angle)
+        along = east * np.sin(angle) + north * np.cos(angle)
+        inside = ((cos_c > 0) & (np.abs(across) <= np.tan(np.radians(width_deg / 2)))
+                  & (np.abs(along) <= np.tan(np.radians(height_deg / 2))))
+        return rows[inside], separation[inside]
+
+def read_catalog_file(file_path):
+    """Return the (size, modification time) of the catalog CSV and its content, the time taken before reading."""
+    stat = os.stat(file_path)
+    with open(file_path, 'rb') as file:
+        return (stat.st_size, stat.st_mtime_ns), file.read()
+
+def nonempty_line_offsets(content, start, end):
+    """Offsets of the lines of content[start:end] with text, the lines the csv module reads as rows."""
+    chunk = np.frombuffer(content, dtype=np.uint8)[start:end]
+    newlines = np.flatnonzero(chunk == 10)
+    begins = np.concatenate(([0], newlines + 1))
+    ends = np.append(newlines, len(chunk))
+    lengths = ends - begins
+    lengths[lengths > 0] -= chunk[ends[lengths > 0] - 1] == 13  # A \r\n line ending
+    return begins[lengths > 0] + start
+
+def row_lines(content, start, end):
+    """
+    The lines of content[start:end] with text, the lines the csv module reads as rows.
+    Returns their offsets, hashes and bytes, as arrays.
+    """
+    lines = content[start:end].split(b'\n')
+    lengths = np.fromiter(map(len, lines), dtype=np.int64, count=len(lines))
+    hashes = np.fromiter(map(hash, lines), dtype=np.int64, count=len(lines))
+    offsets = start + np.concatenate(([0], np.cumsum(lengths + 1)[:-1]))
+    keep = (lengths > 1) | ((lengths == 1) & (hashes != hash(b'\r')))
+    return offsets[keep], hashes[keep], np.array(lines, dtype=object)[keep]
+
+def match_keys(old_keys, new_keys):
+    """
+    Pair the equal keys of two arrays, the k-th occurrence of a key in new_keys with its k-th
+    occurrence in old_keys. Returns the indices of the pairs in old_keys and in new_keys.
+    """
+    old_order, new_order = np.argsort(old_keys, kind='stable'), np.argsort(new_keys, kind='stable')
+    old_sorted, new_sorted = old_keys[old_order], new_keys[new_order]
+    occurrence = np.arange(len(new_sorted)) - np.searchsorted(new_sorted, new_sorted, 'left')
+    candidate = np.searchsorted(old_sorted, new_sorted, 'left') + occurrence
+    paired = candidate < len(old_sorted)
+    paired[paired] = old_sorted[candidate[paired]] == new_sorted[paired]
+    return old_order[candidate[paired]], new_order[paired]
+
+def common_prefix_length(a, b, block=1 << 20):
+    """Length of the common prefix of two uint8 arrays, compared a block at a time."""
+    n = min(len(a), len(b))
+    for i in range(0, n, block):
+        end = min(i + block, n)
+        differ = np.flatnonzero(a[i:end] != b[i:end])
+        if len(differ):
+            return i + int(differ[0])
+    return n
+
+def position(row):
+    """RA and Dec of a CSV row in degrees, NaN when either is not a number."""
+    try:
+        return float(row['RA']), float(row['Dec'])
+    except (ValueError, TypeError):
+        return np.nan, np.nan  # Skip rows with invalid RA/Dec values when computing
+
+def magnitude_value(text):
+    """Numeric magnitude of a Magnitude text, NaN when it is not a number."""
+    try:
+        return float(text)
+    except ValueError:
+        return np.nan
+
+class CelestialCatalog:
+    """
+    Columnar in-memory copy of the celestial catalog CSV.
+    RA and Dec are held as float arrays (NaN where the CSV value is invalid) so positions can
+    be computed for the whole catalog in one astropy call. Each text column is interned: a table
+    of its distinct strings plus an int32 array of indices into that table per row.
+    The file content and the byte offset of each row's line are kept so an edited file can be
+    applied by update, row by row.
+    """
+
+    text_columns = ("Name", "Alt Name", "Type", "Magnitude", "Info", "Catalog")
+    indexed_columns = ("Name", "Alt Name", "Type", "Info")  # Text columns with a TrigramIndex
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.stat_key, self._content = read_catalog_file(file_path)
+        # Content hash of the file, identifies the rows of the catalog in cached results
+        self.fingerprint = hashlib.sha1(self._content).hexdigest()
+
+        self.string_tables = {column: [] for column in self.text_columns}
+        self._string_lookup = {column: {} for column in self.text_columns}
+        codes = {column: [] for column in self.text_columns}
+        ra, dec = [], []
+        reader = csv.DictReader(io.StringIO(self._content.decode('ISO-8859-1'), newline=None))
+        for row in reader:
+            for column in self.text_columns:
+                codes[column].append(self.intern(column, row[column]))
+            row_ra, row_dec = position(row)
+            ra.append(row_ra)
+            dec.append(row_dec)
+        self.fieldnames = reader.fieldnames
+
+        self.codes = {column: np.array(values, dtype=np.int32) for column, values in codes.items()}
+        self.ra = np.array(ra, dtype=np.float64)
+        self.dec = np.array(dec, dtype=np.float64)
+
+        # Numeric magnitude for filtering and sorting, NaN where the CSV value is not a number
+        magnitudes = np.array([magnitude_value(value) for value in self.string_tables["Magnitude"]], dtype=np.float64)
+        self.magnitude = magnitudes[self.codes["Magnitude"]]
+
+        # Byte offset of the line of every row, -1 once removed. None when a quoted value spans
+        # lines, rows can't be found by line then and an edited file is read in full
+        lines = nonempty_line_offsets(self._content, 0, len(self._content))
+        self.line_offsets = lines[1:].astype(np.int64) if len(lines) == len(self) + 1 else None
+        self.header_end = self._content.find(b'\n', lines[0]) + 1 if len(lines) else 0
+
+    def __len__(self):
+        return len(self.ra)
+
+    def intern(self, column, value):
+        """Return the string table index of value in a text column, adding it to the table if new."""
+        lookup = self._string_lookup[column]
+        code = lookup.get(value)
+        if code is None:
+            code = len(self.string_tables[column])
+            self.string_tables[column].append(value)
+            lookup[value] = code
+        return code
+
+    def text(self, column, row):
+        """Return the text of a column for one catalog row."""
+        return self.string_tables[column][self.codes[column][row]]
+
+    def text_array(self, column, rows):
+        """Return the text of a column for an array of catalog rows."""
+        table = self.string_tables[column]
+        return [table[code] for code in self.codes[column][rows]]
+
+    def build_text_index(self):
+        """
+        Build a TrigramIndex over the string table of each indexed column, and the catalog rows of
+        every string (rows grouped by string table index) to turn matching strings into rows.
+        """
+        self.text_index = {}
+        self._rows_by_code = {}
+        self._changed_rows = np.empty(0, dtype=np.int32)  # Rows updated, added or removed since, not in _rows_by_code
+        for column in self.indexed_columns:
+            self.text_index[column] = TrigramIndex(self.string_tables[column])
+            codes = self.codes[column]
+            order = np.argsort(codes, kind='stable').astype(np.int32)
+            offsets = np.concatenate(([0], np.cumsum(np.bincount(codes, minlength=len(self.string_tables[column])))))
+            self._rows_by_code[column] = (order, offsets)
+
+    def rows_with_codes(self, column, codes):
+        """Sorted catalog rows whose text in an indexed column is one of the string table indices in codes."""
+        order, offsets = self._rows_by_code[column]
+        codes = np.asarray(codes)
+        indexed = codes[codes < len(offsets) - 1]  # Strings added since have no rows in the index
+        rows = gather_ranges(order, offsets[indexed], offsets[indexed + 1])
+        if len(self._changed_rows):
+            changed = self._changed_rows
+            rows = np.concatenate((rows[~np.isin(rows, changed)], changed[np.isin(self.codes[column][changed], codes)]))
+        return np.sort(rows)
+
+    def match_text_condition(self, condition):
+        """
+        Sorted catalog rows satisfying one 'like' or '=' condition on an indexed column, exactly as
+        evaluate_conditions would, found through the column's TrigramIndex.
+        """
+        column, operator, value, logic_op = condition
+        table = self.string_tables[column]
+        codes = self.text_index[column].search(value, lambda code: evaluate_conditions({column: table[code]}, [condition]))
+        return self.rows_with_codes(column, codes)
+
+    def build_sky_index(self):
+        """Build the SkyIndex of the catalog positions."""
+        self.sky_index = SkyIndex(self.ra, self.dec)
+
+    def resolve_name(self, name):
+        """
+        Row of an object given by name, ignoring case and spacing ('m31' finds 'M      31'), looking
+        at Name before Alt Name and falling back to the first quick find match. Raises ValueError.
+        """
+        if getattr(self, '_rows_by_name', None) is None:
+            self._rows_by_name = {}
+            for column in ("Name", "Alt Name"):
+                table = self.string_tables[column]
+                codes, first_rows = np.unique(self.codes[column], return_index=True)  # First row of each string
+                for code, row in sorted(zip(codes.tolist(), first_rows.tolist()), key=lambda pair: pair[1]):
+                    if table[code].strip():
+                        self._rows_by_name.setdefault(''.join(table[code].lower().split()), row)
+        row = self._rows_by_name.get(''.join(name.lower().split()))
+        if row is None:
+            matches = self.quick_find(name, limit=1)
+            if not len(matches):
+                raise ValueError(f"Unknown object: {name}")
+            row = int(matches[0])
+        return row
+
+    def match_within_condition(self, condition):
+        """Sorted catalog rows within a 'within' condition's radius, in degrees, of its named object."""
+        column, operator, value, logic_op = condition
+        radius, name = value.split(" of ", 1)
+        row = self.resolve_name(name)
+        rows, separation = self.sky_index.cone(self.ra[row], self.dec[row], float(radius))
+        return np.sort(rows)
+
+    def apply_index_conditions(self, rows, conditions):
+        """
+        Narrow rows by the conditions the text and sky indexes can answer before any coordinates
+        are computed. Returns the remaining rows and the conditions still to be evaluated on the
+        computed results.
+        """
+        remaining = []
+        for condition in conditions:
+            if condition[1] == 'within':
+                rows = np.intersect1d(rows, self.match_within_condition(condition), assume_unique=True)
+            elif self.is_indexed_condition(condition):
+                rows = np.intersect1d(rows, self.match_text_condition(condition), assume_unique=True)
+            else:
+                remaining.append(condition)
+        return rows, remaining
+
+    def is_indexed_condition(self, condition):
+        """True for 'like' conditions, and '=' on text, on an indexed column, their matches contain the value."""
+        column, operator, value, logic_op = condition
+        if column not in self.indexed_columns:
+            return False
+        if operator == 'like':
+            return True
+        try:
+            float(value)  # Numeric equality compares numbers, '070' = '70', not substrings
+            return False
+        except ValueError:
+            return operator == '='
+
+    def quick_find(self, text, limit=50):
+        """
+        Rows whose Name or Alt Name contains text, at most limit of them in catalog order, taken
+        from the first limit matching names of each column. Text shorter than a trigram finds
+        nothing, it would match most of the catalog without the index narrowing it.
+        """
+        if len(normalize_text(text)) < 3:
+            return np.empty(0, dtype=np.int32)
+        rows = np.union1d(*(self.rows_with_codes(column, self.text_index[column].search(text, limit=limit)) for column in ("Name", "Alt Name")))
+        return rows[:limit]
+
+    def select(self, filters):
+        """Return the indices of rows in the selected catalogs that have a valid RA/Dec."""
+        mask = np.isfinite(self.ra) & np.isfinite(self.dec)
+        if filters:
+            selected = [code for code, catalog in enumerate(self.string_tables["Catalog"]) if catalog.strip() in filters]
+            mask &= np.isin(self.codes["Catalog"], selected)
+        return np.flatnonzero(mask)
+
+    def index_names(self, row, add=True):
+        """Add a row to, or remove it from, the name lookup of resolve_name if it has been built."""
+        rows_by_name = getattr(self, '_rows_by_name', None)
+        if rows_by_name is not None:
+            for column in ("Name", "Alt Name"):
+                name = ''.join(self.text(column, row).lower().split())
+                if name and add:
+                    rows_by_name.setdefault(name, row)
+                elif name and rows_by_name.get(name) == row:
+                    del rows_by_name[name]
+
+    def set_row(self, row, values):
+        """Set the text and position of a row from a CSV row dict, returning True if any of them changed."""
+        codes = {column: self.intern(column, values[column]) for column in self.text_columns}
+        ra, dec = position(values)
+        if (all(self.codes[column][row] == code for column, code in codes.items())
+                and np.array_equal([self.ra[row], self.dec[row]], [ra, dec], equal_nan=True)):
+            return False
+        self.index_names(row, add=False)
+        for column, code in codes.items():
+            self.codes[column][row] = code
+        self.ra[row], self.dec[row] = ra, dec
+        self.magnitude[row] = magnitude_value(values["Magnitude"])
+        return True
+
+    def update(self, max_changed_rows=4096):
+        """
+        Apply an edit of the CSV, touching only the rows on the lines that differ from the content
+        read last. Rows are matched by identity (Name and Catalog): a matched row is updated in
+        place, a new row is appended and a row no longer in the file is left as a tombstone with no
+        text or position, so row numbers in results already computed stay valid. The indexes take
+        the changed rows as they are, once more than max_changed_rows have changed they are built
+        again. Returns the counts of changed, added and removed rows, or None when the header or
+        most of the rows changed and the file is better read again.
+        """
+        stat_key, content = read_catalog_file(self.file_path)
+        old = self._content
+        if content == old:
+            self.stat_key = stat_key  # Saved without changes
+            return {"changed": 0, "added": 0, "removed": 0}
+        if self.line_offsets is None:
+            return None
+
+        # The changed bytes, widened to whole lines, are content[start:new_end] in place of old[start:old_end]
+        old_bytes, new_bytes = np.frombuffer(old, dtype=np.uint8), np.frombuffer(content, dtype=np.uint8)
+        start = common_prefix_length(old_bytes, new_bytes)
+        start = old.rfind(b'\n', 0, start) + 1
+        tail = min(common_prefix_length(old_bytes[::-1], new_bytes[::-1]), len(old) - start, len(content) - start)
+        old_end, new_end = len(old) - tail, len(content) - tail
+        line_start = lambda buffer, i: i in (0, len(buffer)) or buffer[i - 1] == 10
+        if not (line_start(old, old_end) and line_start(content, new_end)):
+            newline = old.find(b'\n', old_end)
+            shift = (len(old) if newline < 0 else newline + 1) - old_end
+            old_end, new_end = old_end + shift, new_end + shift
+
+        if start < self.header_end or self.header_end == 0:
+            return None  # The header changed
+        old_rows = np.flatnonzero((self.line_offsets >= start) & (self.line_offsets < old_end))
+        old_rows = old_rows[np.argsort(self.line_offsets[old_rows], kind='stable')]
+        old_offsets, old_hashes, old_lines = row_lines(old, start, old_end)
+        new_offsets, new_hashes, new_lines = row_lines(content, start, new_end)
+        if len(old_offsets) != len(old_rows):
+            return None
+
+        # Edits far apart leave unchanged lines between them, their rows only move
+        old_unchanged, new_unchanged = match_keys(old_hashes, new_hashes)
+        same = old_lines[old_unchanged] == new_lines[new_unchanged]  # Lines that only share a hash are edits
+        old_unchanged, new_unchanged = old_unchanged[same], new_unchanged[same]
+        moved_rows, moved_offsets = old_rows[old_unchanged], new_offsets[new_unchanged]
+        edited_rows = np.delete(old_rows, old_unchanged).tolist()
+        edited = np.delete(np.arange(len(new_offsets)), new_unchanged)
+        if len(edited_rows) + len(edited) > len(self) // 2 + 100:
+            return None  # Reading the file again is as quick
+        text = b'\n'.join(new_lines[edited]).decode('ISO-8859-1')
+        new_rows = list(csv.DictReader(io.StringIO(text, newline=None), fieldnames=self.fieldnames))
+        if len(new_rows) != len(edited):
+            return None  # A quoted value spans lines
+
+        # Pair the old and new rows of the edited lines by identity, in file order among rows of the same Name and Catalog
+        unmatched = {}
+        for row in edited_rows:
+            unmatched.setdefault((self.text("Name", row), self.text("Catalog", row)), []).append(row)
+        matched, added = [], []
+        for values, offset in zip(new_rows, new_offsets[edited].tolist()):
+            rows = unmatched.get((values["Name"], values["Catalog"]))
+            if rows:
+                matched.append((rows.pop(0), values, offset))
+            else:
+                added.append((values, offset))
+        removed = [row for rows in unmatched.values() for row in rows]
+
+        # Lines after the edit moved by the change in its length
+        self.line_offsets[self.line_offsets >= old_end] += new_end - old_end
+        self.line_offsets[moved_rows] = moved_offsets
+        changed = []
+        for row, values, offset in matched:
+            self.line_offsets[row] = offset
+            if self.set_row(row, values):
+                self.index_names(row)
+                changed.append(row)
+        tombstone = dict.fromkeys(self.text_columns + ("RA", "Dec"), "")
+        for row in removed:
+            self.set_row(row, tombstone)
+            self.line_offsets[row] = -1
+
+        if added:
+            first = len(self)
+            codes = {column: [self.intern(column, values[column]) for values, offset in added] for column in self.text_columns}
+            positions = np.array([position(values) for values, offset in added], dtype=np.float64).reshape(-1, 2)
+            self.codes = {column: np.concatenate((self.codes[column], np.array(codes[column], dtype=np.int32))) for column in self.text_columns}
+            self.ra = np.concatenate((self.ra, positions[:, 0]))
+            self.dec = np.concatenate((self.dec, positions[:, 1]))
+            self.magnitude = np.concatenate((self.magnitude, [magnitude_value(values["Magnitude"]) for values, offset in added]))
+            self.line_offsets = np.concatenate((self.line_offsets, [offset for values, offset in added]))
+            for row in range(first, len(self)):
+                self.index_names(row)
+
+        # Bring the indexes up to date, or build them again once the changes outgrow them
+        touched = np.array(changed + removed + list(range(len(self) - len(added), len(self))), dtype=np.int32)
+        self._changed_rows = np.union1d(self._changed_rows, touched).astype(np.int32)
+        if len(self._changed_rows) > max_changed_rows:
+            self.build_text_index()
+            self.build_sky_index()
+        else:
+            for column in self.indexed_columns:
+                self.text_index[column].extend(self.string_tables[column])
+            self.sky_index.update(self.ra, self.dec, touched)
+
+        # The row layout now depends on the edits, chain them into the fingerprint
+        if len(touched):
+            self.fingerprint = hashlib.sha1(f"{self.fingerprint}:{start}:{old_end}:".encode('utf-8') + content[start:new_end]).hexdigest()
+        self._content, self.stat_key = content, stat_key
+        return {"changed": len(changed), "added": len(added), "removed": len(removed)}
+
+_catalog_cache = {}
+_catalog_holds = {}  # Catalogs whose edits are held back while they are read, with the number of holders
+
+def update_catalog(file_path):
+    """
+    Return the columnar catalog for the CSV and what changed since it was last read: None when
+    the file was read in full, else the counts of changed, added and removed rows. A catalog
+    already in memory is updated row by row when the file is modified, unless its updates are
+    held by hold_catalog_updates, then it is returned as it is.
+    """
+    file_path = os.path.abspath(file_path)
+    stat = os.stat(file_path)
+    catalog = _catalog_cache.get(file_path)
+    if catalog is not None:
+        if catalog.stat_key == (stat.st_size, stat.st_mtime_ns) or _catalog_holds.get(file_path):
+            return catalog, {"changed": 0, "added": 0, "removed": 0}
+        changes = catalog.update()
+        if changes is not None:
+            return catalog, changes
+    catalog = CelestialCatalog(file_path)
+    catalog.build_text_index()
+    catalog.build_sky_index()
+    _catalog_cache[file_path] = catalog
+    return catalog, None
+
+@contextlib.contextmanager
+def hold_catalog_updates(file_path):
+    """Keep the catalog in memory as it is while the block reads it, edits of the CSV are applied afterwards."""
+    file_path = os.path.abspath(file_path)
+    _catalog_holds[file_path] = _catalog_holds.get(file_path, 0) + 1
+    try:
+        yield
+    finally:
+        _catalog_holds[file_path] -= 1
+
+def load_catalog(file_path):
+    """Return the columnar catalog for the CSV, up to date with the file."""
+    return update_catalog(file_path)[0]
+
+def modified_catalogs():
+    """Paths of the catalogs in memory whose CSV was modified since it was read."""
+    modified = []
+    for file_path, catalog in list(_catalog_cache.items()):
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            continue  # Being replaced, or removed
+        if (stat.st_size, stat.st_mtime_ns) != catalog.stat_key:
+            modified.append(file_path)
+    return modified
+
 # Convert Right Ascension from degrees to RA in HH:MM:SS format
 def degrees_to_ra(degrees):
     hours = int(degrees // 15)
@@ -188,20 +808,107 @@ def calculate_transit_and_alt_az(ra_deg, dec_deg, latitude, longitude, local_tim
 
     return transit_time_minutes, local_transit_time.strftime("%H:%M:%S"), before_after, altitude, azimuth
 
+def calculate_transit_and_alt_az_array(ra_deg, dec_deg, latitude, longitude, local_time):
+    """
+    Vectorized calculate_transit_and_alt_az for arrays of RA/Dec in one astropy transform.
+    Returns arrays of the signed transit offset in hours (positive when the transit is after
+    local_time), altitude and azimuth.
+    """
+    astropy_time = Time(local_time.astimezone(pytz.utc))
+    location = EarthLocation(lat=latitude * u.deg, lon=longitude * u.deg, height=0 * u.m)
+    targets = SkyCoord(ra=ra_deg * u.deg, dec=dec_deg * u.deg)
+
+    altaz_coord = targets.transform_to(AltAz(obstime=astropy_time, location=location))
+
+    # Transit occurs when the LST matches the RA of the object, kept within [-12, +12] hours
+    lst = astropy_time.sidereal_time('mean', longitude * u.deg).hour
+    time_diff_hours = np.asarray(ra_deg) / 15.0 - lst
+    time_diff_hours = np.where(time_diff_hours > 12, time_diff_hours - 24, time_diff_hours)
+    time_diff_hours = np.where(time_diff_hours < -12, time_diff_hours + 24, time_diff_hours)
+
+    return time_diff_hours, altaz_coord.alt.deg, altaz_coord.az.deg
+
+def calculate_multi_site_alt_az(ra_deg, dec_deg, latitudes, longitudes, utc_times, chunk_size=100000):
+    """
+    Transit offset (hours), altitude and azimuth of every object at every site, as arrays shaped (sites, objects).
+
+    Each site is evaluated at its own UTC time. The objects are transformed to apparent (TETE)
+    coordinates once, which changes by well under an arcsecond over a day, then each site only
+    needs its apparent sidereal time and a few multiply-adds per object, broadcast over
+    (sites x objects) in chunks of objects to bound memory. Agrees with the AltAz transform
+    in calculate_transit_and_alt_az_array to about an arcsecond.
+    """
+    times = Time([t.astimezone(pytz.utc) for t in utc_times])
+    latitudes = np.radians(np.asarray(latitudes, dtype=np.float64))[:, np.newaxis]
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+
+    # The only astropy transform, shared by every site
+    apparent = SkyCoord(ra=ra_deg * u.deg, dec=dec_deg * u.deg).transform_to(TETE(obstime=times[0]))
+    apparent_ra, apparent_dec = apparent.ra.rad, apparent.dec.rad
+
+    # Local sidereal times of all sites in one call, apparent for alt/az, mean for the transit times
+    last = times.sidereal_time('apparent', longitude=longitudes * u.deg).rad[:, np.newaxis]
+    lmst = times.sidereal_time('mean', longitude=longitudes * u.deg).hour[:, np.newaxis]
+    sin_last, cos_last = np.sin(last), np.cos(last)
+    sin_lat, cos_lat = np.sin(latitudes), np.cos(latitudes)
+
+    site_count, object_count = len(times), len(apparent_ra)
+    time_diff_hours = np.empty((site_count, object_count))
+    altitude = np.empty((site_count, object_count))
+    azimuth = np.empty((site_count, object_count))
+    for start in range(0, object_count, chunk_size):
+        chunk = slice(start, start + chunk_size)
+        sin_ra, cos_ra = np.sin(apparent_ra[chunk]), np.cos(apparent_ra[chunk])
+        sin_dec, cos_dec = np.sin(apparent_dec[chunk]), np.cos(apparent_dec[chunk])
+
+        # Hour angle H = LAST - RA, expanded so the per-site work is multiply-adds
+        cos_ha = cos_last * cos_ra + sin_last * sin_ra
+        sin_ha = sin_last * cos_ra - cos_last * sin_ra
+        altitude[:, chunk] = np.degrees(np.arcsin(np.clip(sin_lat * sin_dec + cos_lat * cos_dec * cos_ha, -1, 1)))
+        azimuth[:, chunk] = np.degrees(np.arctan2(-cos_dec * sin_ha, sin_dec * cos_lat - cos_dec * sin_lat * cos_ha)) % 360
+
+        # Transit occurs when the LST matches the RA of the object, kept within [-12, +12] hours
+        diff = np.asarray(ra_deg[chunk]) / 15.0 - lmst
+        diff = np.where(diff > 12, diff - 24, diff)
+        time_diff_hours[:, chunk] = np.where(diff < -12, diff + 24, diff)
+
+    return time_diff_hours, altitude, azimuth
+
+def angular_separation_deg(ra1, dec1, ra2, dec2):
+    """Angular separation in degrees between RA/Dec positions in degrees, broadcasting like numpy (Vincenty formula)."""
+    ra1, dec1, ra2, dec2 = (np.radians(value) for value in (ra1, dec1, ra2, dec2))
+    sin_dra, cos_dra = np.sin(ra2 - ra1), np.cos(ra2 - ra1)
+    sin_dec1, cos_dec1 = np.sin(dec1), np.cos(dec1)
+    sin_dec2, cos_dec2 = np.sin(dec2), np.cos(dec2)
+
+    num1 = cos_dec2 * sin_dra
+    num2 = cos_dec1 * sin_dec2 - sin_dec1 * cos_dec2 * cos_dra
+    denominator = sin_dec1 * sin_dec2 + cos_dec1 * cos_dec2 * cos_dra
+    return np.degrees(np.arctan2(np.hypot(num1, num2), denominator))
+
 def parse_query_conditions(query, valid_columns):
     """Parse the query and validate column names against valid columns."""
     
     # Regex to capture the column name (which may include spaces), operator (including LIKE), value, and logical operators (AND, OR, +, |)
     pattern = r"([a-zA-Z_][\w\s]*)\s*(>|>=|<|<=|=|!=|like)\s*('[^']*'|\"[^\"]*\"|[\w\.]+)\s*(AND|OR|\+|\|)?"
-    
+
+    # 'within <degrees> of <name>' keeps objects near a named one, answered by the catalog's SkyIndex
+    within_pattern = r"within\s+(\d+(?:\.\d*)?|\.\d+)\s+of\s+('[^']*'|\"[^\"]*\"|[\w\.]+)\s*(AND|OR|\+|\|)?"
+
     conditions = []
+    for match in re.finditer(within_pattern, query, re.IGNORECASE):
+        radius, name, logic_op = match.groups()
+        name = name.strip("'\"")
+        conditions.append(("Within", "within", f"{float(radius)} of {name}", logic_op))
+    query = re.sub(within_pattern, " ", query, flags=re.IGNORECASE)
+
     for match in re.finditer(pattern, query, re.IGNORECASE):
         column, operator, value, logic_op = match.groups()
         column = column.lower().strip()  # Normalize column name to lowercase and strip spaces
 
         if column in valid_columns:
             # Prepare the structure for execution later, storing the valid column, operator, and value
-            conditions.append((valid_columns[column], operator, value.strip("'\""), logic_op))
+            conditions.append((valid_columns[column], operator.lower(), value.strip("'\""), logic_op))
         else:
             raise ValueError(f"Invalid column: {column}")
 
@@ -215,8 +922,8 @@ def evaluate_conditions(row, conditions):
     for column, operator, value, logic_op in conditions:
         row_value = row[column]
 
-        # Perform type conversions and handle degree symbol if present
-        row_value = row_value.strip('°')  # Remove degree symbol if present
+        # Perform type conversions and handle degree or percent symbol if present
+        row_value = row_value.strip('°%')  # Remove degree or percent symbol if present
 
         # Attempt to convert both row_value and value to float if they are numeric
         def is_numeric(value):
@@ -256,34 +963,654 @@ def evaluate_conditions(row, conditions):
 
     return True  # If all conditions pass, return True
 
+# Raw values of a search result row, text columns are read from the catalog through 'row'
+result_dtype = np.dtype([
+    ('row', np.int32),             # Row number in the CelestialCatalog
+    ('ra', np.float64),            # Degrees
+    ('dec', np.float64),           # Degrees
+    ('transit_hours', np.float64), # Signed offset of the transit from the search time, positive is after
+    ('altitude', np.float64),
+    ('azimuth', np.float64),
+    ('moon_sep', np.float64),
+    ('min_moon_sep', np.float64),  # NaN when the night has no astronomical darkness
+    ('best_date', np.float64),     # Date ordinal of the night the transit is nearest local midnight
+    ('season_start', np.float64),  # Date ordinals of the longest run of nights the object is well placed,
+    ('season_end', np.float64),    # NaN when there is none
+    ('season_nights', np.float64)  # Nights in the season
+])
+
+class ResultSet:
+    """
+    Columnar search result, a structured array of raw values (result_dtype) plus the catalog
+    the rows came from, the search time and the Moon's illuminated fraction at that time.
+    Display strings are only formatted when a consumer asks for them.
+    """
+
+    columns = ("Name", "RA", "Dec", "Transit Time", "Relative TT", "Before/After", "Altitude", "Azimuth",
+               "Moon Sep", "Min Moon Sep", "Moon Illum", "Alt Name", "Type", "Magnitude", "Info", "Catalog",
+               "Best Date", "Season Start", "Season End", "Season Nights")
+
+    # Display columns formatted as a plain number from a raw field
+    float_fields = {"Dec": "dec", "Altitude": "altitude", "Azimuth": "azimuth", "Moon Sep": "moon_sep", "Min Moon Sep": "min_moon_sep"}
+
+    # Display columns formatted as a yyyy-mm-dd date from a raw date ordinal, compared as strings
+    date_fields = {"Best Date": "best_date", "Season Start": "season_start", "Season End": "season_end"}
+
+    # Columns filled by calculate_best_dates, conditions on them are evaluated after the others
+    season_columns = ("Best Date", "Season Start", "Season End", "Season Nights")
+
+    def __init__(self, catalog, data, local_time, moon_illumination):
+        self.catalog = catalog
+        self.data = data
+        self.local_time = local_time
+        self.moon_illumination = moon_illumination
+
+    def __len__(self):
+        return len(self.data)
+
+    def subset(self, selection):
+        """Return a ResultSet holding the rows picked by a boolean mask or index array."""
+        return ResultSet(self.catalog, self.data[selection], self.local_time, self.moon_illumination)
+
+    def transit_time(self, i):
+        """Local transit datetime of result row i."""
+        return self.local_time + timedelta(hours=float(self.data['transit_hours'][i]))
+
+    def numeric(self, column):
+        """
+        Raw numeric values of a column for filtering, NaN where the displayed value is not a number.
+        Returns None for columns displayed as text (including times), which are compared as strings.
+        """
+        if column in self.float_fields:
+            return self.data[self.float_fields[column]]
+        if column == "Moon Illum":
+            return np.full(len(self), self.moon_illumination * 100)
+        if column == "Magnitude":
+            return self.catalog.magnitude[self.data['row']]
+        if column == "Season Nights":
+            return self.data['season_nights']
+        return None
+
+    def format_column(self, column):
+        """Display strings of a column for every row."""
+        data = self.data
+        if column in CelestialCatalog.text_columns:
+            return self.catalog.text_array(column, data['row'])
+        if column == "RA":
+            return [degrees_to_ra(ra) for ra in data['ra'].tolist()]
+        if column == "Dec":
+            return [format_dec(dec) for dec in data['dec'].tolist()]
+        if column == "Transit Time":
+            return [(self.local_time + timedelta(hours=hours)).strftime("%H:%M:%S") for hours in data['transit_hours'].tolist()]
+        if column == "Relative TT":
+            return [format_transit_time(abs(hours * 60)) for hours in data['transit_hours'].tolist()]
+        if column == "Before/After":
+            return ["After" if hours >= 0 else "Before" for hours in data['transit_hours'].tolist()]
+        if column == "Moon Illum":
+            return [f"{self.moon_illumination * 100:.0f}%"] * len(self)
+        if column in self.date_fields:
+            return [date.fromordinal(int(value)).isoformat() if value == value else "" for value in data[self.date_fields[column]].tolist()]
+        if column == "Season Nights":
+            return [f"{value:.0f}" if value == value else "" for value in data['season_nights'].tolist()]
+        return [f"{value:.2f}°" if value == value else "" for value in data[self.float_fields[column]].tolist()]
+
+    def format(self, i, column):
+        """Display string of a column for result row i."""
+        return self.subset(slice(i, i + 1)).format_column(column)[0]
+
+    def values(self, i, columns=None):
+        """Display strings of result row i, in Treeview column order by default."""
+        return tuple(self.format(i, column) for column in (columns or self.columns))
+
+    def rows(self, columns=None):
+        """Display string tuples of every row, formatted a column at a time."""
+        return zip(*(self.format_column(column) for column in (columns or self.columns)))
+
+    def sort_order(self, column, reverse=False):
+        """Row order sorting a column by its raw value, times chronologically and text alphabetically."""
+        if column == "Transit Time":
+            keys = self.data['transit_hours']
+        elif column == "Relative TT":
+            keys = np.abs(self.data['transit_hours'])
+        elif column == "RA":
+            keys = self.data['ra']
+        elif column in self.date_fields:
+            keys = self.data[self.date_fields[column]]
+        elif column in CelestialCatalog.text_columns and column != "Magnitude":
+            keys = np.array(self.catalog.text_array(column, self.data['row']))
+        elif column == "Before/After":
+            keys = np.array(self.format_column(column))
+        else:
+            keys = self.numeric(column)
+        order = np.argsort(keys, kind='stable')
+        return order[::-1] if reverse else order
+
+    def export_array(self, column):
+        """
+        Typed values of a column for data exports: RA and Dec in degrees, Relative TT in minutes and
+        the other numeric columns as floats (NaN when blank), times and text as strings.
+        """
+        if column == "RA":
+            return self.data['ra']
+        if column == "Relative TT":
+            return np.abs(self.data['transit_hours'] * 60)
+        numeric = self.numeric(column)
+        if numeric is not None:
+            return numeric
+        if column in CelestialCatalog.text_columns:
+            return np.array(self.catalog.text_array(column, self.data['row']), dtype=str)
+        return np.array(self.format_column(column), dtype=str)
+
+    def save(self, file):
+        """Write the result set to an .npz file (a path or binary file object)."""
+        meta = {
+            "utc_time": self.local_time.astimezone(pytz.utc).isoformat(),
+            "timezone": self.local_time.tzinfo.zone,
+            "moon_illumination": float(self.moon_illumination)
+        }
+        np.savez(file, data=self.data, meta=np.array(json.dumps(meta)))
+
+    @classmethod
+    def load(cls, file, catalog):
+        """Read a result set written by save(), its rows refer to the given catalog."""
+        with np.load(file, allow_pickle=False) as archive:
+            data = archive['data']
+            meta = json.loads(str(archive['meta']))
+        local_time = datetime.fromisoformat(meta["utc_time"]).astimezone(pytz.timezone(meta["timezone"]))
+        return cls(catalog, data, local_time, meta["moon_illumination"])
+
+def build_result_data(rows, ra, dec, time_diff_hours, altitude, azimuth, above_horizon=True):
+    """Structured result_dtype array of the objects (above the horizon by default), Moon and season columns are left for the caller."""
+    visible = altitude >= 0 if above_horizon else np.ones(len(rows), dtype=bool)  # Skip objects below horizon
+    data = np.zeros(np.count_nonzero(visible), dtype=result_dtype)
+    data['row'] = rows[visible]
+    data['ra'], data['dec'] = ra[visible], dec[visible]
+    data['transit_hours'], data['altitude'], data['azimuth'] = time_diff_hours[visible], altitude[visible], azimuth[visible]
+    for field in ('best_date', 'season_start', 'season_end', 'season_nights'):
+        data[field] = np.nan  # Filled by calculate_best_dates where it is run
+    return data
+
+class MultiSiteResult:
+    """
+    Results of one search of the catalogs in filters evaluated at several sites: a ResultSet
+    per site, plus a combined view of every target that passed at any site with its altitude
+    at each site and the best (highest) site it passed at.
+    """
+
+    def __init__(self, sites, site_results, filters, has_best_dates=False):
+        self.sites = sites
+        self.site_results = site_results
+        self.filters = filters
+        self.has_best_dates = [has_best_dates] * len(sites)
+        self.catalog = site_results[0].catalog
+
+        self.rows = np.unique(np.concatenate([results.data['row'] for results in site_results]))
+        self.altitude = np.full((len(sites), len(self.rows)), np.nan)  # NaN where the target failed at the site
+        for s, results in enumerate(site_results):
+            self.altitude[s, np.searchsorted(self.rows, results.data['row'])] = results.data['altitude']
+        self.best_site = np.argmax(np.nan_to_num(self.altitude, nan=-np.inf), axis=0) if len(self.rows) else np.zeros(0, dtype=int)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def fill_best_dates(self, s, season=default_season):
+        """Calculate the best dates of site s's results, if the search didn't already need them."""
+        if not self.has_best_dates[s]:
+            site, results = self.sites[s], self.site_results[s]
+            fill_best_dates(results.data, float(site["latitude"]), float(site["longitude"]), results.local_time, season)
+            self.has_best_dates[s] = True
+
+def evaluate_multi_site(file_path, sites, date_str, time_str, filters, conditions, is_cancelled=None, season=default_season):
+    """
+    Evaluate a search at every site in one broadcast (sites x objects) computation.
+    Sites are dicts with name, latitude, longitude and timezone, and each site is
+    evaluated at the given local date and time in its own timezone. The best dates are only
+    calculated when a condition needs them, per site for the rows kept by the other conditions,
+    otherwise they are left for MultiSiteResult.fill_best_dates.
+    Returns a MultiSiteResult, or None if canceled.
+    """
+    catalog = load_catalog(file_path)
+    candidates, conditions = catalog.apply_index_conditions(catalog.select(filters), conditions)
+    season_conditions = [condition for condition in conditions if condition[0] in ResultSet.season_columns]
+    conditions = [condition for condition in conditions if condition[0] not in ResultSet.season_columns]
+    ra, dec = catalog.ra[candidates], catalog.dec[candidates]
+    naive_time = datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M")
+    local_times = [pytz.timezone(site["timezone"]).localize(naive_time) for site in sites]
+    latitudes = [float(site["latitude"]) for site in sites]
+    longitudes = [float(site["longitude"]) for site in sites]
+
+    time_diff_hours, altitude, azimuth = calculate_multi_site_alt_az(ra, dec, latitudes, longitudes, local_times)
+
+    site_results = []
+    for s, local_time in enumerate(local_times):
+        if is_cancelled and is_cancelled():
+            return None
+        data = build_result_data(candidates, ra, dec, time_diff_hours[s], altitude[s], azimuth[s])
+        moon_ra, moon_dec, _, _, moon_illum = calculate_moon_position(latitudes[s], longitudes[s], local_time)
+        data['moon_sep'] = angular_separation_deg(data['ra'], data['dec'], moon_ra, moon_dec)
+        data['min_moon_sep'] = np.nan  # The dark window is not computed per site
+        results = ResultSet(catalog, data, local_time, moon_illum)
+        results = results.subset(evaluate_conditions_array(results, conditions))
+        if season_conditions:
+            fill_best_dates(results.data, latitudes[s], longitudes[s], local_time, season)
+            results = results.subset(evaluate_conditions_array(results, season_conditions))
+        site_results.append(results)
+
+    return MultiSiteResult(sites, site_results, filters, has_best_dates=bool(season_conditions))
+
+def evaluate_conditions_array(results, conditions):
+    """
+    Evaluate parsed conditions on every row of a ResultSet, returning a boolean mask.
+    Numeric comparisons on numeric columns run as array operations on the raw values, any other
+    condition falls back to evaluate_conditions on the formatted value of the rows still selected.
+    """
+    mask = np.ones(len(results), dtype=bool)
+    comparisons = {'>': np.greater, '>=': np.greater_equal, '<': np.less, '<=': np.less_equal, '=': np.equal, '!=': np.not_equal}
+
+    for condition in conditions:
+        column, operator, value, logic_op = condition
+        numeric = results.numeric(column)
+        try:
+            number = float(value)
+        except ValueError:
+            number = None
+
+        if numeric is not None and number is not None and operator in comparisons:
+            valid = np.isfinite(numeric)
+            mask[valid] &= comparisons[operator](numeric[valid], number)
+            remaining = np.flatnonzero(mask & ~valid)  # Blank or text values are compared as strings
+        else:
+            remaining = np.flatnonzero(mask)
+
+        formatted = results.subset(remaining).format_column(column) if len(remaining) else []
+        for i, row_value in zip(remaining, formatted):
+            mask[i] = evaluate_conditions({column: row_value}, [condition])
+
+    return mask
+
+def normalize_conditions(conditions):
+    """
+    Reduce parsed query conditions to a canonical form for use in cache keys.
+    evaluate_conditions ANDs every condition, so the logical operators and the
+    order of the conditions do not change the result and are dropped.
+    """
+    normalized = set()
+    for column, operator, value, logic_op in conditions:
+        try:
+            value = repr(float(value))  # '02', '2' and '2.0' are the same number
+        except ValueError:
+            value = str(value).lower()
+        normalized.add((column, operator.lower(), value))
+    return sorted(normalized)
+
+class ResultCache:
+    """
+    Disk-backed cache of search results in the app data folder.
+    Each entry is a ResultSet .npz file named by the hash of its key, the file modification time is
+    used as the last access time for LRU eviction. Entries live in a folder per COMPUTE_VERSION
+    and folders from other versions are removed when the cache is opened.
+    """
+
+    def __init__(self, max_entries=200, max_bytes=100 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        base_dir = get_app_data_path(result_cache_dirname)
+        self.cache_dir = os.path.join(base_dir, f"v{COMPUTE_VERSION}")
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # Versioned invalidation, results computed by other versions of the compute code are stale
+        for entry in os.listdir(base_dir):
+            entry_path = os.path.join(base_dir, entry)
+            if entry_path != self.cache_dir and os.path.isdir(entry_path):
+                shutil.rmtree(entry_path, ignore_errors=True)
+
+    @staticmethod
+    def make_key(file_path, latitude, longitude, local_time, filters, conditions, season=default_season):
+        """Build the cache key for a search, the time is bucketed to the UTC minute."""
+        key = {
+            "version": COMPUTE_VERSION,
+            "catalog": load_catalog(file_path).fingerprint,  # Content and row layout of the catalog
+            "latitude": round(latitude, 6),
+            "longitude": round(longitude, 6),
+            "utc_minute": local_time.astimezone(pytz.utc).strftime("%Y-%m-%dT%H:%M"),
+            "timezone": str(local_time.tzinfo),  # Transit Time is formatted in local time
+            "catalogs": sorted(filters),
+            "conditions": normalize_conditions(conditions),
+            "season": [float(value) for value in season]  # Minimum altitude and dark hours of the season columns
+        }
+        return hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def get(self, key, catalog):
+        """Return the cached ResultSet for the key, or None on a cache miss. The key includes the catalog fingerprint."""
+        entry_path = self._entry_path(key)
+        try:
+            results = ResultSet.load(entry_path, catalog)
+            os.utime(entry_path)  # Mark as most recently used
+            return results
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, key, results):
+        """Store the ResultSet for the key and evict the least recently used entries if over budget."""
+        entry_path = self._entry_path(key)
+        temp_path = f"{entry_path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'wb') as file:
+                results.save(file)
+            os.replace(temp_path, entry_path)  # Atomic so a reader never sees a partial entry
+        except OSError as e:
+            print(f"Error writing result cache: {e}")
+            return
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is within its size bounds."""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.npz'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort(reverse=True)  # Most recently used first
+
+        total_bytes = 0
+        for index, (_, size, path) in enumerate(entries):
+            total_bytes += size
+            if index >= self.max_entries or total_bytes > self.max_bytes:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def clear(self):
+        """Remove every cached result."""
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+class EphemerisDataManager:
+    """
+    Offline-first handling of astropy's IERS Earth orientation tables, used for sidereal time and
+    every alt/az transform. Automatic downloads are off unless enabled, so a search never waits
+    on a network timeout. The IERS-A table bundled in astropy-iers-data is used, or a newer
+    finals2000A file imported from disk, which is kept in the app data folder. Whichever holds
+    the most recent measurements is made astropy's earth orientation table. Times past its
+    predictions are converted with degraded accuracy (UT1-UTC taken as the last value, a
+    warning instead of an error), the table only needs refreshing for sub-second timing.
+    """
+
+    imported_filename = 'finals2000A.all'
+
+    def __init__(self, auto_download=False):
+        iers_dir = get_app_data_path(iers_dirname)
+        os.makedirs(iers_dir, exist_ok=True)
+        self.imported_path = os.path.join(iers_dir, self.imported_filename)
+        self.table = None
+        self.source = None
+        self.lock = threading.Lock()
+        self.set_auto_download(auto_download)
+
+    def set_auto_download(self, auto_download):
+        """Allow or stop astropy downloading IERS and leap second updates when its tables look stale."""
+        self.auto_download = auto_download
+        iers.conf.auto_download = auto_download
+        # Without downloads the bundled table ages, times past it must still convert
+        iers.conf.iers_degraded_accuracy = 'error' if auto_download else 'warn'
+        if self.table is not None:
+            # None restores astropy's auto-updating table
+            iers.earth_orientation_table.set(None if auto_download else self.table)
+
+    @property
+    def is_loaded(self):
+        return self.table is not None
+
+    @staticmethod
+    def last_measured(table):
+        """Date of the last measured (not predicted) UT1-UTC value in an IERS-A table."""
+        return Time(np.max(table['MJD'][table['UT1Flag'] != 'P']), format='mjd').to_datetime().date()
+
+    @staticmethod
+    def predicted_until(table):
+        """Date of the last predicted value in an IERS-A table."""
+        return Time(np.max(table['MJD']), format='mjd').to_datetime().date()
+
+    def load(self):
+        """Open the bundled and imported tables, keep the most recent one and make astropy use it."""
+        with self.lock:
+            if self.table is not None:
+                return self.table
+
+            tables = [("bundled", iers.IERS_A.open(iers.IERS_A_FILE))]
+            if os.path.exists(self.imported_path):
+                try:
+                    tables.append(("imported", iers.IERS_A.open(self.imported_path)))
+                except Exception as e:
+                    print(f"Error reading imported IERS table: {e}")
+            self.source, self.table = max(tables, key=lambda entry: self.last_measured(entry[1]))
+
+            if not self.auto_download:
+                iers.earth_orientation_table.set(self.table)
+            return self.table
+
+    def import_table(self, file_path):
+        """
+        Validate a finals2000A IERS-A file and copy it to the app data folder, then reload.
+        Raises ValueError if the file is not a readable IERS-A table.
+        """
+        try:
+            table = iers.IERS_A.open(file_path)
+            self.last_measured(table)
+        except Exception as e:
+            raise ValueError(f"Not an IERS-A finals2000A file: {e}")
+
+        temp_path = f"{self.imported_path}.{os.getpid()}.tmp"
+        shutil.copy(file_path, temp_path)
+        os.replace(temp_path, self.imported_path)
+        with self.lock:
+            self.table = None
+        self.load()
+
+    def describe(self, today=None):
+        """Short description of the table in use and the age of its measurements for the UI."""
+        if self.table is None:
+            return "Loading..."
+        today = today or date.today()
+        measured = self.last_measured(self.table)
+        predicted = self.predicted_until(self.table)
+        download = ", auto-download on" if self.auto_download else ", degraded accuracy after that"
+        return (f"{self.source.capitalize()} IERS-A measured to {measured} ({(today - measured).days} days old), "
+                f"predicted to {predicted}{download}")
+
+    def warm_up(self, latitude, longitude, timezone_str):
+        """
+        Load the tables and run one small transit, Moon, twilight and best dates calculation so the
+        caches behind them are filled before the first search, including the twilight tables of
+        every year the season columns' nights fall in.
+        """
+        self.load()
+        now = datetime.now(pytz.timezone(timezone_str))
+        calculate_transit_and_alt_az_array(np.zeros(1), np.zeros(1), latitude, longitude, now)
+        calculate_moon_position(latitude, longitude, now)
+        try:
+            calculate_astronomical_dusk_dawn(latitude, longitude, night_start_date(now), timezone_str)
+        except (ValueError, AttributeError):
+            pass  # No astronomical darkness at this latitude tonight
+        fill_best_dates(np.zeros(1, dtype=result_dtype), latitude, longitude, now)
+
+# Sun altitudes (degrees) of the twilight crossings, sunset and sunrise are the centre of the Sun
+# on the horizon without refraction, the same as astroplan's default horizon
+twilight_altitudes = {"sun": 0.0, "civil": -6.0, "nautical": -12.0, "astronomical": -18.0}
+
+def sun_altitude_grid(latitude, longitude, start_utc, minutes, step_minutes):
+    """
+    Altitude of the Sun (degrees) every step_minutes for minutes from start_utc, at a site.
+    The Sun's apparent (TETE) position and the apparent sidereal time are computed by astropy on
+    a 6 hour grid and interpolated, both change smoothly, then the altitude of every step is a
+    few array operations. Agrees with an AltAz transform to about 0.003 degrees.
+    UT1 is taken as UTC (within 0.9 s), so no IERS table is needed for any year.
+    """
+    start = Time(start_utc)
+    offsets = np.arange(0, minutes + 1, step_minutes) * 60.0
+    coarse_offsets = np.arange(0, minutes + 6 * 60 + 1, 6 * 60) * 60.0
+    coarse = start + coarse_offsets * u.s
+    coarse.delta_ut1_utc = np.zeros(len(coarse_offsets))
+
+    sun = get_sun(coarse).transform_to(TETE(obstime=coarse))
+    sun_ra = np.interp(offsets, coarse_offsets, np.unwrap(sun.ra.rad))
+    sun_dec = np.interp(offsets, coarse_offsets, sun.dec.rad)
+    last = np.interp(offsets, coarse_offsets, np.unwrap(coarse.sidereal_time('apparent', longitude=longitude * u.deg).rad))
+
+    lat = np.radians(latitude)
+    sin_alt = np.sin(lat) * np.sin(sun_dec) + np.cos(lat) * np.cos(sun_dec) * np.cos(last - sun_ra)
+    return np.degrees(np.arcsin(np.clip(sin_alt, -1, 1)))
+
+class TwilightTable:
+    """
+    One year of sunset, sunrise and twilight crossings at a site, from a single sun_altitude_grid.
+    Crossings are found by linear interpolation between 5 minute steps (well within a minute) and
+    kept as sorted arrays of UTC timestamps, separately for evening (setting) and morning (rising)
+    crossings of each altitude in twilight_altitudes. The grid runs a few days past both ends of
+    the year so the nights at either end can be looked up in any timezone.
+    The Sun's hourly altitude is kept too, to tell nights that are dark throughout from nights
+    that never get dark.
+    """
+
+    step_minutes = 5
+
+    def __init__(self, latitude, longitude, year, start, crossings, hourly_altitude):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.year = year
+        self.start = start                      # UTC timestamp of the first grid step
+        self.crossings = crossings              # {"astronomical_evening": array, ...} UTC timestamps
+        self.hourly_altitude = hourly_altitude  # Sun altitude each hour from start
+
+    @classmethod
+    def build(cls, latitude, longitude, year):
+        """Compute the table for a site and calendar year."""
+        start_time = datetime(year - 1, 12, 30, tzinfo=pytz.utc)
+        minutes = int((datetime(year + 1, 1, 3, tzinfo=pytz.utc) - start_time).total_seconds() // 60)
+        altitude = sun_altitude_grid(latitude, longitude, start_time, minutes, cls.step_minutes)
+        start = start_time.timestamp()
+        step_seconds = cls.step_minutes * 60.0
+
+        crossings = {}
+        for kind, horizon in twilight_altitudes.items():
+            above = altitude > horizon
+            k = np.flatnonzero(above[:-1] != above[1:])
+            times = start + (k + (horizon - altitude[k]) / (altitude[k + 1] - altitude[k])) * step_seconds
+            crossings[f"{kind}_evening"] = times[above[k]]
+            crossings[f"{kind}_morning"] = times[~above[k]]
+
+        return cls(latitude, longitude, year, start, crossings, altitude[::60 // cls.step_minutes])
+
+    def save(self, file):
+        """Write the table to a .npz file (path or binary file object)."""
+        meta = {"latitude": self.latitude, "longitude": self.longitude, "year": self.year, "start": self.start}
+        np.savez(file, meta=np.array(json.dumps(meta)), hourly_altitude=self.hourly_altitude, **self.crossings)
+
+    @classmethod
+    def load(cls, file):
+        """Read a table written by save()."""
+        with np.load(file, allow_pickle=False) as archive:
+            meta = json.loads(str(archive['meta']))
+            crossings = {key: archive[key] for key in archive.files if key not in ('meta', 'hourly_altitude')}
+            return cls(meta["latitude"], meta["longitude"], meta["year"], meta["start"], crossings, archive['hourly_altitude'])
+
+    def sun_altitude(self, timestamps):
+        """Sun altitude (degrees) at UTC timestamps, interpolated from the hourly altitudes."""
+        return np.interp(timestamps, self.start + np.arange(len(self.hourly_altitude)) * 3600.0, self.hourly_altitude)
+
+    def windows(self, kind, night_dates, timezone_str, dark_all_night=False):
+        """
+        Evening and morning crossings of a twilight kind for the nights starting on night_dates,
+        as arrays of UTC timestamps. A night runs from local noon to the next local noon, the
+        evening crossing is the first setting one in it and the morning crossing the first rising
+        one after that. NaN where the Sun does not cross both ways. With dark_all_night, when the
+        Sun is already below the altitude at noon the night starts at noon, and when it does not
+        rise again the night ends at the next noon, as in polar winter.
+        """
+        timezone = pytz.timezone(timezone_str)
+        night_dates = list(night_dates)
+        noons = np.array([timezone.localize(datetime.combine(night_date, time(12, 0))).timestamp()
+                          for night_date in night_dates + [night_dates[-1] + timedelta(days=1)]])
+        night_starts, night_ends = noons[:-1], noons[1:]
+
+        def first_after(crossings, after):
+            """First crossing at or after each time and before the night's end, NaN if there is none."""
+            first = np.full(len(after), np.nan)
+            if len(crossings):
+                i = np.minimum(np.searchsorted(crossings, np.nan_to_num(after, nan=np.inf)), len(crossings) - 1)
+                found = (crossings[i] >= after) & (crossings[i] < night_ends)
+                first[found] = crossings[i[found]]
+            return first
+
+        evening = first_after(self.crossings[f"{kind}_evening"], night_starts)
+        if dark_all_night:
+            dark_at_noon = np.isnan(evening) & (self.sun_altitude(night_starts) < twilight_altitudes[kind])
+            evening[dark_at_noon] = night_starts[dark_at_noon]
+        morning = first_after(self.crossings[f"{kind}_morning"], evening)
+        if dark_all_night:
+            stays_dark = np.isfinite(evening) & np.isnan(morning)
+            morning[stays_dark] = night_ends[stays_dark]
+        evening[np.isnan(morning)] = np.nan
+        return evening, morning
+
+    def night(self, kind, night_date, timezone_str):
+        """
+        Evening and morning crossings of a twilight kind for the night starting on night_date, as
+        datetimes in the timezone. Raises ValueError when the Sun does not cross that night.
+        """
+        evening, morning = self.windows(kind, [night_date], timezone_str)
+        if np.isnan(evening[0]):
+            raise ValueError(f"The Sun does not cross {twilight_altitudes[kind]:.0f}° on the night of {night_date}")
+        timezone = pytz.timezone(timezone_str)
+        return (datetime.fromtimestamp(evening[0], timezone), datetime.fromtimestamp(morning[0], timezone))
+
+_twilight_tables = {}
+
+def get_twilight_table(latitude, longitude, year):
+    """
+    Return the twilight table of a site and year, from memory, the app data folder, or built and saved there.
+    The site is rounded to 4 decimal places (about 10 m), far below what changes a twilight time.
+    """
+    latitude, longitude = round(latitude, 4), round(longitude, 4)
+    key = (latitude, longitude, year)
+    table = _twilight_tables.get(key)
+    if table is None:
+        table_dir = get_app_data_path(twilight_dirname)
+        os.makedirs(table_dir, exist_ok=True)
+        table_path = os.path.join(table_dir, f"{latitude:+.4f}_{longitude:+.4f}_{year}.npz")
+        try:
+            table = TwilightTable.load(table_path)
+        except (OSError, ValueError, KeyError):
+            table = TwilightTable.build(latitude, longitude, year)
+            temp_path = f"{table_path}.{os.getpid()}.tmp"
+            try:
+                with open(temp_path, 'wb') as file:
+                    table.save(file)
+                os.replace(temp_path, table_path)
+            except OSError as e:
+                print(f"Error writing twilight table: {e}")
+        _twilight_tables[key] = table
+    return table
+
 def calculate_sunset_sunrise(latitude, longitude, date, timezone_str):
     """Calculates the sunset and sunrise times for a given location and date.
 
     Args:
         latitude: Latitude in degrees.
         longitude: Longitude in degrees.
-        date: Date as a datetime.date object.
+        date: Date the night starts on, as a datetime.date object.
         timezone_str: Timezone string (e.g., 'Australia/Sydney').
 
     Returns:
         A tuple of datetime objects representing sunset and sunrise times, respectively.
+        Raises ValueError if the Sun does not set that night.
     """
+    return get_twilight_table(latitude, longitude, date.year).night("sun", date, timezone_str)
 
-    # Convert date to a datetime at midnight for Astropy Time
-    date_with_time = datetime.combine(date, time(0, 0))  # Use 'time' from 'datetime'
-
-    time_obj = Time(date_with_time, scale='utc')  # Using a datetime object
-
-    location = EarthLocation(lat=latitude * u.deg, lon=longitude * u.deg)
-    timezone = pytz.timezone(timezone_str)
-    observer = Observer(location=location, timezone=timezone)
-
-    # Calculate sunset and sunrise times
-    sunset_time = observer.sun_set_time(time_obj, which='nearest').to_datetime(timezone)
-    sunrise_time = observer.sun_rise_time(time_obj, which='next').to_datetime(timezone)
-
-    return sunset_time, sunrise_time
-    
 # Function to calculate astronomical dusk and dawn
 def calculate_astronomical_dusk_dawn(latitude, longitude, date, timezone_str):
     """Calculates the times for astronomical dusk and dawn on a given date and location.
@@ -291,30 +1618,171 @@ def calculate_astronomical_dusk_dawn(latitude, longitude, date, timezone_str):
     Args:
         latitude: Latitude in degrees.
         longitude: Longitude in degrees.
-        date: Date as a datetime object.
+        date: Date the night starts on, as a datetime.date object.
         timezone_str: Timezone string (e.g., 'US/Eastern').
 
     Returns:
         A tuple of datetime objects representing dusk and dawn times, respectively.
+        Raises ValueError if there is no astronomical darkness that night.
     """
+    return get_twilight_table(latitude, longitude, date.year).night("astronomical", date, timezone_str)
 
-    location = EarthLocation(lat=latitude * u.deg, lon=longitude * u.deg)
+def dark_windows(latitude, longitude, first_night, nights, timezone_str, kind="astronomical"):
+    """
+    Dates and twilight windows of consecutive nights at a site, from the twilight tables of the
+    years they fall in. Returns the dates and arrays of the evening and morning UTC timestamps,
+    polar nights are dark from noon to noon and nights without darkness are NaN.
+    """
+    dates = [first_night + timedelta(days=i) for i in range(nights)]
+    evening, morning = np.full(nights, np.nan), np.full(nights, np.nan)
+    for year in sorted({night_date.year for night_date in dates}):
+        indices = [i for i, night_date in enumerate(dates) if night_date.year == year]
+        evening[indices], morning[indices] = get_twilight_table(latitude, longitude, year).windows(
+            kind, [dates[i] for i in indices], timezone_str, dark_all_night=True)
+    return dates, evening, morning
+
+def longest_circular_runs(flags):
+    """
+    Start index and length of the longest run of True in each row of a 2D boolean array, runs
+    may wrap from the last column to the first. Rows without a True have length 0.
+    """
+    n = flags.shape[1]
+    doubled = np.concatenate((flags, flags), axis=1)
+    count = np.cumsum(doubled, axis=1, dtype=np.int16)
+    run = count - np.maximum.accumulate(np.where(doubled, 0, count), axis=1)  # Run length ending at each column
+    end = np.argmax(run, axis=1)
+    length = np.minimum(run[np.arange(len(flags)), end], n)
+    start = np.where(length >= n, 0, (end - length + 1) % n)
+    return start, length
+
+SIDEREAL_RATE = 1.00273790935  # Sidereal hours per solar hour
+
+def calculate_best_dates(ra_deg, dec_deg, latitude, longitude, first_night, timezone_str, min_altitude=30, min_hours=2,
+                         nights=365, chunk_size=1000):
+    """
+    The best dates of the year for each object, starting from the night of first_night.
+    The best date is the night the object transits nearest local midnight. The season is the
+    longest run of nights on which it spends at least min_hours of astronomical darkness above
+    min_altitude, runs may wrap around the year.
+
+    Above min_altitude an object's hour angle is within +-H0, where cos(H0) comes from its
+    declination and the latitude, so it is up over an arc of local sidereal time around its RA.
+    Each night's darkness is also an arc of sidereal time, starting at the sidereal time of dusk.
+    The hours an object is up in darkness are the overlap of the two arcs, computed for every
+    (object, night) pair as array operations in chunks of objects. Only the sidereal times of
+    dusk and midnight on each night need astropy, in one call, with UT1 taken as UTC (within
+    0.9 s) so no IERS table is needed however far ahead the year runs.
+
+    Returns arrays of the best date, season start and end as date ordinals (season NaN when
+    there is none) and the number of nights in the season.
+    """
+    ra_hours = np.asarray(ra_deg) / 15.0
+    dec = np.radians(np.asarray(dec_deg))
+    dates, evening, morning = dark_windows(latitude, longitude, first_night, nights, timezone_str)
     timezone = pytz.timezone(timezone_str)
+    midnights = np.array([timezone.localize(datetime.combine(night_date + timedelta(days=1), time(0, 0))).timestamp() for night_date in dates])
+
+    # Sidereal time at local midnight and at dusk, nights without darkness get a zero length window
+    has_darkness = np.isfinite(evening)
+    times = Time(np.concatenate((midnights, np.where(has_darkness, evening, midnights))), format='unix')
+    times.delta_ut1_utc = np.zeros(2 * nights)
+    sidereal = times.sidereal_time('mean', longitude=longitude * u.deg).hour
+    midnight_lst, dusk_lst = sidereal[:nights].astype(np.float32), sidereal[nights:].astype(np.float32)
+    dark_arc = np.where(has_darkness, np.minimum((morning - evening) / 3600 * SIDEREAL_RATE, 24), 0).astype(np.float32)
+
+    ordinals = np.array([night_date.toordinal() for night_date in dates], dtype=np.float64)
+
+    # Hour angle limit of each object above min_altitude, the arc it is up is 2 * H0 sidereal hours
+    lat = np.radians(latitude)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cos_h0 = (np.sin(np.radians(min_altitude)) - np.sin(lat) * np.sin(dec)) / (np.cos(lat) * np.cos(dec))
+    half_arc = np.degrees(np.arccos(np.clip(cos_h0, -1, 1))) / 15.0
+    up_arc = np.where(cos_h0 <= -1, 24.0, 2 * half_arc)  # Circumpolar above min_altitude, 0 if it never gets there
+
+    best_date = np.full(len(ra_hours), np.nan)
+    season_start = np.full(len(ra_hours), np.nan)
+    season_end = np.full(len(ra_hours), np.nan)
+    season_nights = np.zeros(len(ra_hours))
+    for start in range(0, len(ra_hours), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        ra_chunk = ra_hours[chunk].astype(np.float32)[:, np.newaxis]
+
+        # Best date, the night whose midnight sidereal time is nearest the RA (not monotonic across daylight saving changes)
+        best_date[chunk] = ordinals[np.argmin(np.abs((ra_chunk - midnight_lst + 12) % 24 - 12), axis=1)]
+
+        arc = up_arc[chunk, np.newaxis].astype(np.float32)
+        x = ((ra_hours[chunk] - half_arc[chunk]).astype(np.float32)[:, np.newaxis] - dusk_lst) % 24  # Up arc start, relative to dusk
+        overlap = np.clip(np.minimum(x + arc, dark_arc) - x, 0, None) + np.clip(np.minimum(x + arc - 24, dark_arc), 0, None)
+        overlap = np.where(arc >= 24, dark_arc, overlap)
+        run_start, run_length = longest_circular_runs(overlap / SIDEREAL_RATE >= min_hours)
+
+        found = run_length > 0
+        season_start[chunk] = np.where(found, ordinals[run_start], np.nan)
+        season_end[chunk] = np.where(found, ordinals[run_start] + run_length - 1, np.nan)
+        season_nights[chunk] = run_length
+    return best_date, season_start, season_end, season_nights
+
+def fill_best_dates(data, latitude, longitude, local_time, season=default_season):
+    """
+    Fill the best date and season fields of result_dtype rows for the year from the night of
+    local_time. They stay NaN when the twilight tables can't be computed, so the season columns
+    never fail a search.
+    """
+    try:
+        best_dates = calculate_best_dates(data['ra'], data['dec'], latitude, longitude, night_start_date(local_time),
+                                          local_time.tzinfo.zone, *season)
+    except (ValueError, IndexError):  # IERSRangeError is an IndexError
+        return
+    data['best_date'], data['season_start'], data['season_end'], data['season_nights'] = best_dates
 
-    # Create an Observer object
-    observer = Observer(location=location, timezone=timezone)
+def calculate_moon_position(latitude, longitude, local_time):
+    """Calculates the Moon's topocentric RA/Dec, Alt/Az and illuminated fraction (0-1) at a local time.
 
-    # Calculate local midnight in UTC
-    date_midnight_utc = Time(datetime.combine(date, datetime.min.time()), scale='utc')
+    Args:
+        latitude: Latitude in degrees.
+        longitude: Longitude in degrees.
+        local_time: Timezone aware datetime.
 
-    # Define dusk and dawn altitude
-    dusk_dawn_altitude = -18 * u.deg
+    Returns:
+        A tuple of (ra, dec, altitude, azimuth) in degrees and the illuminated fraction.
+    """
+    astropy_time = Time(local_time.astimezone(pytz.utc))
+    location = EarthLocation(lat=latitude * u.deg, lon=longitude * u.deg, height=0 * u.m)
+
+    moon = get_body('moon', astropy_time, location)
+    moon_altaz = moon.transform_to(AltAz(obstime=astropy_time, location=location))
+    illumination = float(moon_illumination(astropy_time))
+
+    return moon.ra.deg, moon.dec.deg, moon_altaz.alt.deg, moon_altaz.az.deg, illumination
+
+def calculate_moon_track(latitude, longitude, dusk_time, dawn_time, step_minutes=15):
+    """Topocentric RA/Dec arrays (degrees) of the Moon on a time grid from dusk to dawn."""
+    steps = max(int((dawn_time - dusk_time).total_seconds() // (step_minutes * 60)), 0) + 1
+    times = [dusk_time.astimezone(pytz.utc) + timedelta(minutes=step_minutes * i) for i in range(steps)]
+    location = EarthLocation(lat=latitude * u.deg, lon=longitude * u.deg, height=0 * u.m)
+    moon = get_body('moon', Time(times), location)
+    return moon.ra.deg, moon.dec.deg
 
-    # Use Observer methods to directly calculate dusk and dawn
-    dusk_time = observer.sun_set_time(date_midnight_utc, which='next', horizon=dusk_dawn_altitude).to_datetime(timezone)
-    dawn_time = observer.sun_rise_time(date_midnight_utc, which='next', horizon=dusk_dawn_altitude).to_datetime(timezone)
+def calculate_min_moon_separation(ra_deg, dec_deg, latitude, longitude, dusk_time, dawn_time, step_minutes=15, chunk_size=100000):
+    """
+    Minimum angular separation in degrees between each object and the Moon over the dark window.
+    The Moon is positioned once on a shared time grid from dusk to dawn, then the separation of
+    every object from every grid position is computed as one array operation per chunk of objects.
+    """
+    moon_track = calculate_moon_track(latitude, longitude, dusk_time, dawn_time, step_minutes)
+    return min_separation_from_track(ra_deg, dec_deg, moon_track, chunk_size)
+
+def min_separation_from_track(ra_deg, dec_deg, moon_track, chunk_size=100000):
+    """Minimum separation in degrees of each object from the positions of a calculate_moon_track grid."""
+    moon_ra, moon_dec = moon_track[0][np.newaxis, :], moon_track[1][np.newaxis, :]
 
-    return dusk_time, dawn_time
+    ra_deg, dec_deg = np.asarray(ra_deg), np.asarray(dec_deg)
+    min_separation = np.empty(len(ra_deg))
+    for start in range(0, len(ra_deg), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        separation = angular_separation_deg(ra_deg[chunk, np.newaxis], dec_deg[chunk, np.newaxis], moon_ra, moon_dec)
+        min_separation[chunk] = separation.min(axis=1)
+    return min_separation
 
 def generate_altitude_data(ra_deg, dec_deg, latitude, longitude, date, timezone_str, dusk_time, dawn_time):
     """Generate altitude data for a celestial object from half an hour before dusk to half an hour after dawn."""
@@ -341,6 +1809,303 @@ def generate_altitude_data(ra_deg, dec_deg, latitude, longitude, date, timezone_
     
     return altitude_data
 
+def night_start_date(local_time):
+    """Return the date the night containing local_time started on, times before noon belong to the previous evening."""
+    return local_time.date() if local_time.hour >= 12 else local_time.date() - timedelta(days=1)
+
+def build_altitude_grid(ra_deg, dec_deg, latitude, longitude, times):
+    """
+    Altitude (degrees) and airmass of every object at every time in one astropy transform.
+    Returns two arrays shaped (objects, times), airmass is inf below the horizon.
+    """
+    location = EarthLocation(lat=latitude * u.deg, lon=longitude * u.deg, height=0 * u.m)
+    targets = SkyCoord(ra=np.asarray(ra_deg)[:, np.newaxis] * u.deg, dec=np.asarray(dec_deg)[:, np.newaxis] * u.deg)
+    altaz_frame = AltAz(obstime=Time([t.astimezone(pytz.utc) for t in times])[np.newaxis, :], location=location)
+    altitude = targets.transform_to(altaz_frame).alt.deg
+
+    with np.errstate(divide='ignore'):
+        airmass = np.where(altitude > 0, 1 / np.sin(np.radians(altitude)), np.inf)
+    return altitude, airmass
+
+def group_targets(ra_deg, dec_deg, priorities, radius_deg):
+    """
+    Group targets that fit in one frame, for imaging them together. Targets are taken by
+    descending priority, each target not yet grouped becomes the centre of a frame holding
+    every ungrouped target within radius_deg of it. Returns lists of target indices, the frame
+    centre first, in the order the frames were made.
+    """
+    ra_deg, dec_deg = np.asarray(ra_deg, dtype=np.float64), np.asarray(dec_deg, dtype=np.float64)
+    sky_index = SkyIndex(ra_deg, dec_deg)
+    grouped = np.zeros(len(ra_deg), dtype=bool)
+    groups = []
+    for centre in np.argsort(-np.asarray(priorities, dtype=np.float64), kind='stable').tolist():
+        if grouped[centre]:
+            continue
+        members, separation = sky_index.cone(ra_deg[centre], dec_deg[centre], radius_deg)
+        members = members[~grouped[members]]
+        grouped[members] = True
+        groups.append([centre] + [int(i) for i in members if i != centre])
+    return groups
+
+def plan_imaging_session(names, ra_deg, dec_deg, latitude, longitude, dusk_time, dawn_time, priorities=None,
+                         min_altitude=30, min_duration_minutes=30, max_duration_minutes=120, slot_minutes=10):
+    """
+    Allocate the dark window between dusk and dawn to targets, slot by slot.
+
+    Each slot of every target is scored on one altitude grid as
+    priority * (how close the target is to its best altitude of the night) / airmass,
+    slots below min_altitude can't be used. Blocks are allocated greedily: the free window of
+    min_duration_minutes with the highest total score seeds a block, which then grows towards
+    its better neighbouring slot until max_duration_minutes or the target is no longer usable.
+    Each target is scheduled at most once.
+
+    Returns a list of plan entries (dicts) ordered by start time.
+    """
+    slot = timedelta(minutes=slot_minutes)
+    slot_count = int((dawn_time - dusk_time) / slot)
+    if slot_count <= 0 or len(names) == 0:
+        return []
+    slot_starts = [dusk_time + slot * i for i in range(slot_count)]
+
+    # Score at the middle of each slot
+    altitude, airmass = build_altitude_grid(ra_deg, dec_deg, latitude, longitude, [t + slot / 2 for t in slot_starts])
+    priorities = np.ones(len(names)) if priorities is None else np.asarray(priorities, dtype=np.float64)
+    best_altitude = altitude.max(axis=1, keepdims=True)
+    usable = altitude >= min_altitude
+    with np.errstate(divide='ignore', invalid='ignore'):
+        nearness = np.clip((altitude - min_altitude) / (best_altitude - min_altitude), 0, 1)
+        nearness = np.where(best_altitude > min_altitude, nearness, 1.0)
+    score = np.where(usable, priorities[:, np.newaxis] * (0.5 + 0.5 * nearness) / airmass, -np.inf)
+
+    min_slots = max(int(np.ceil(min_duration_minutes / slot_minutes)), 1)
+    max_slots = max(int(max_duration_minutes // slot_minutes), min_slots)
+    if min_slots > slot_count:
+        return []
+
+    free = np.ones(slot_count, dtype=bool)
+    scheduled = np.zeros(len(names), dtype=bool)
+    blocks = []
+    while free.any():
+        available = np.where(free[np.newaxis, :] & ~scheduled[:, np.newaxis], score, -np.inf)
+
+        # Total score of every min_slots long window, windows with an unusable slot are excluded
+        finite = np.isfinite(available)
+        window_score = np.cumsum(np.where(finite, available, 0), axis=1)
+        window_usable = np.cumsum(finite, axis=1)
+        window_score = np.concatenate([window_score[:, min_slots - 1:min_slots], window_score[:, min_slots:] - window_score[:, :-min_slots]], axis=1)
+        window_usable = np.concatenate([window_usable[:, min_slots - 1:min_slots], window_usable[:, min_slots:] - window_usable[:, :-min_slots]], axis=1)
+        window_score = np.where(window_usable == min_slots, window_score, -np.inf)
+
+        target, start = np.unravel_index(np.argmax(window_score), window_score.shape)
+        if not np.isfinite(window_score[target, start]):
+            break  # No target fits in the remaining free slots
+        end = start + min_slots
+
+        # Grow the block towards whichever neighbouring slot scores better for this target
+        target_score = available[target]
+        while end - start < max_slots:
+            before = target_score[start - 1] if start > 0 else -np.inf
+            after = target_score[end] if end < slot_count else -np.inf
+            if not np.isfinite(before) and not np.isfinite(after):
+                break
+            if after >= before:
+                end += 1
+            else:
+                start -= 1
+
+        free[start:end] = False
+        scheduled[target] = True
+        blocks.append((start, end, target))
+
+    plan = []
+    for start, end, target in sorted(blocks):
+        block_altitude = altitude[target, start:end]
+        plan.append({
+            "Target": names[target],
+            "Start": slot_starts[start].strftime("%H:%M"),
+            "End": (slot_starts[end - 1] + slot).strftime("%H:%M"),
+            "Minutes": int(end - start) * slot_minutes,
+            "Start Alt": round(float(block_altitude[0]), 1),
+            "Peak Alt": round(float(block_altitude.max()), 1),
+            "End Alt": round(float(block_altitude[-1]), 1),
+            "Min Airmass": round(float(airmass[target, start:end].min()), 2),
+            "Priority": float(priorities[target])
+        })
+    return plan
+
+plan_columns = ("Target", "Start", "End", "Minutes", "Start Alt", "Peak Alt", "End Alt", "Min Airmass", "Priority")
+
+def export_plan_csv(plan, file_path):
+    """Write an imaging plan to a CSV file."""
+    with open(file_path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.DictWriter(file, fieldnames=plan_columns)
+        writer.writeheader()
+        writer.writerows(plan)
+
+def export_plan_json(plan, file_path, site=None):
+    """Write an imaging plan to a JSON file, with the site and dark window it was planned for."""
+    with open(file_path, 'w', encoding='utf-8') as file:
+        json.dump({"site": site or {}, "plan": plan}, file, indent=4)
+
+def ics_text(text):
+    """Escape text for an iCalendar property value."""
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+def ics_fold(line):
+    """Fold an iCalendar content line into lines of at most 75 octets, continuation lines start with a space."""
+    lines, current = [], ""
+    for char in line:
+        if len((current + char).encode('utf-8')) > 75:
+            lines.append(current)
+            current = " "
+        current += char
+    lines.append(current)
+    return lines
+
+def export_best_dates_ics(results, file_path, season=default_season, rows=None):
+    """
+    Write the best dates of result rows (all by default) to an iCalendar file, an all-day event
+    on the night each object transits at midnight and an event spanning its season.
+    """
+    min_altitude, min_hours = season
+    stamp = datetime.now(pytz.utc).strftime("%Y%m%dT%H%M%SZ")
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//TonightSky//Best Dates//EN", "CALSCALE:GREGORIAN"]
+
+    def add_event(uid, first_day, last_day, summary, description):
+        lines.extend(["BEGIN:VEVENT", f"UID:{uid}@tonightsky", f"DTSTAMP:{stamp}",
+                      f"DTSTART;VALUE=DATE:{first_day.strftime('%Y%m%d')}",
+                      f"DTEND;VALUE=DATE:{(last_day + timedelta(days=1)).strftime('%Y%m%d')}",  # DTEND is exclusive
+                      f"SUMMARY:{ics_text(summary)}", f"DESCRIPTION:{ics_text(description)}", "END:VEVENT"])
+
+    data = results.data
+    for i in (range(len(results)) if rows is None else rows):
+        record = data[i]
+        name = ' '.join(results.catalog.text("Name", record['row']).split())
+        uid = re.sub(r'[^\w-]', '', f"{name}-{results.catalog.text('Catalog', record['row'])}")
+        if np.isfinite(record['best_date']):
+            best_date = date.fromordinal(int(record['best_date']))
+            add_event(f"{uid}-best-{best_date:%Y%m%d}", best_date, best_date, f"{name} transits at midnight",
+                      f"{name} ({results.catalog.text('Alt Name', record['row']).strip()}) is highest in the middle of the night")
+        if np.isfinite(record['season_start']):
+            season_start, season_end = date.fromordinal(int(record['season_start'])), date.fromordinal(int(record['season_end']))
+            add_event(f"{uid}-season-{season_start:%Y%m%d}", season_start, season_end, f"{name} season",
+                      f"{name} is above {min_altitude:g}° for at least {min_hours:g} hours of astronomical darkness "
+                      f"on each of these {int(record['season_nights'])} nights")
+    lines.append("END:VCALENDAR")
+
+    with open(file_path, 'w', newline='', encoding='utf-8') as file:
+        file.write(''.join(f"{folded}\r\n" for line in lines for folded in ics_fold(line)))
+
+export_formats = {"csv": "CSV", "ndjson": "NDJSON", "npz": "Columnar NumPy (npz)"}
+
+def iter_result_chunks(results, chunk_size=50000):
+    """Yield a ResultSet in consecutive chunks."""
+    for start in range(0, len(results), chunk_size):
+        yield results.subset(slice(start, start + chunk_size))
+
+def iter_catalog_evaluation(file_path, latitude, longitude, local_time, chunk_size=50000, filters=(), season=default_season):
+    """
+    Evaluate every row of the catalogs in filters (all by default) with a valid RA/Dec, including
+    those below the horizon, at a site and time.
+    Yields ResultSets of chunk_size rows so memory stays constant whatever the catalog size,
+    the Moon is positioned once and shared by all chunks.
+    """
+    catalog = load_catalog(file_path)
+    rows = catalog.select(list(filters))
+    moon_ra, moon_dec, _, _, moon_illum = calculate_moon_position(latitude, longitude, local_time)
+    try:
+        dusk_time, dawn_time = calculate_astronomical_dusk_dawn(latitude, longitude, night_start_date(local_time), local_time.tzinfo.zone)
+        moon_track = calculate_moon_track(latitude, longitude, dusk_time, dawn_time)
+    except (ValueError, AttributeError):
+        moon_track = None  # No astronomical darkness on this night at this latitude
+
+    for start in range(0, len(rows), chunk_size):
+        chunk_rows = rows[start:start + chunk_size]
+        ra, dec = catalog.ra[chunk_rows], catalog.dec[chunk_rows]
+        time_diff_hours, altitude, azimuth = calculate_transit_and_alt_az_array(ra, dec, latitude, longitude, local_time)
+        data = build_result_data(chunk_rows, ra, dec, time_diff_hours, altitude, azimuth, above_horizon=False)
+        data['moon_sep'] = angular_separation_deg(ra, dec, moon_ra, moon_dec)
+        data['min_moon_sep'] = np.nan if moon_track is None else min_separation_from_track(ra, dec, moon_track)
+        fill_best_dates(data, latitude, longitude, local_time, season)
+        yield ResultSet(catalog, data, local_time, moon_illum)
+
+def export_results(chunks, total_rows, file_path, file_format, columns, progress_callback=None, is_cancelled=None):
+    """
+    Stream ResultSet chunks to a CSV (table formatted values), NDJSON or columnar npz file
+    (typed values from ResultSet.export_array, one array per column).
+    The npz columns are filled through memory mapped .npy files and zipped at the end, so no
+    format holds more than one chunk in memory. Returns the number of rows written, or None if
+    canceled. A canceled or failed export removes its partial file.
+    """
+    written = 0
+    file = None
+    partial = False  # Whether file_path holds a partial export to remove
+    temp_dir = f"{file_path}.parts"
+    try:
+        if file_format == "csv":
+            file = open(file_path, 'w', newline='', encoding='utf-8')
+            partial = True
+            writer = csv.writer(file)
+            writer.writerow(columns)
+        elif file_format == "ndjson":
+            file = open(file_path, 'w', encoding='utf-8')
+            partial = True
+        else:
+            os.makedirs(temp_dir, exist_ok=True)
+            column_files = {}
+
+        for chunk in chunks:
+            if is_cancelled and is_cancelled():
+                raise InterruptedError
+            count = len(chunk)
+            if file_format == "csv":
+                writer.writerows(chunk.rows(columns))
+            elif file_format == "ndjson":
+                arrays = [chunk.export_array(column).tolist() for column in columns]
+                for values in zip(*arrays):
+                    record = {column: (None if isinstance(value, float) and value != value else value) for column, value in zip(columns, values)}
+                    file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            else:
+                for column in columns:
+                    values = chunk.export_array(column)
+                    if column not in column_files:
+                        # Text width is not known up front, size it from the string table or formatted width
+                        dtype = values.dtype if values.dtype.kind == 'f' else np.dtype(f"U{text_column_width(chunk, column)}")
+                        column_files[column] = np.lib.format.open_memmap(os.path.join(temp_dir, f"{len(column_files)}.npy"), mode='w+', dtype=dtype, shape=(total_rows,))
+                    column_files[column][written:written + count] = values
+            written += count
+            if progress_callback and total_rows:
+                progress_callback(int(written / total_rows * 100))
+
+        if file_format == "npz":
+            with zipfile.ZipFile(file_path, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+                partial = True
+                for index, column in enumerate(columns):
+                    if column in column_files:
+                        column_files[column].flush()
+                        del column_files[column]  # Release the memory map before zipping the file
+                        archive.write(os.path.join(temp_dir, f"{index}.npy"), arcname=f"{column}.npy")
+        return written
+    except BaseException as e:
+        if file:
+            file.close()
+            file = None
+        if partial and os.path.exists(file_path):
+            os.remove(file_path)
+        if isinstance(e, InterruptedError):
+            return None  # Canceled
+        raise
+    finally:
+        if file:
+            file.close()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def text_column_width(results, column):
+    """Maximum width of a text column over the whole catalog (or fixed formatted width) for fixed width arrays."""
+    if column in CelestialCatalog.text_columns:
+        return max((len(value) for value in results.catalog.string_tables[column]), default=1) or 1
+    return {"Transit Time": 8, "Before/After": 6}.get(column, 32)
+
 def plot_altitude_graph(object_name, altitude_data, transit_time, dusk_time, dawn_time):
     """Plot the altitude vs time graph with night shading and vertical lines for transit and midnight."""
     times, altitudes = zip(*altitude_data)
@@ -402,17 +2167,118 @@ def plot_altitude_graph(object_name, altitude_data, transit_time, dusk_time, daw
     plt.show(block=False)
     root.destroy()  # Destroy the Tkinter root after plotting
 
+class ComputeWorker:
+    """
+    A single long-lived background thread that runs compute requests from a queue.
+
+    Every request belongs to a channel (e.g. "search") and is given the next generation number
+    of that channel, submitting a request supersedes any older request on the same channel.
+    Superseded requests still waiting in the queue are skipped, a running one sees
+    is_current() turn False and should stop early. Requests never touch Tk widgets, they post
+    callbacks to the result queue which the Tk main loop drains with drain_results().
+    If a request raises, on_error(channel, message) is posted in its place.
+    A long request can call run_pending() between its steps to let other channels' requests
+    run ahead of its remaining work.
+    """
+
+    def __init__(self, on_error=None):
+        self.on_error = on_error
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.generations = {}
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name="ComputeWorker", daemon=True)
+        self.thread.start()
+
+    def submit(self, channel, func, *args):
+        """Queue func(generation, *args) to run on the worker, returns the request's generation."""
+        with self.lock:
+            generation = self.generations.get(channel, 0) + 1
+            self.generations[channel] = generation
+        self.requests.put((channel, generation, func, args))
+        return generation
+
+    def cancel(self, channel):
+        """Supersede every queued or running request on the channel."""
+        with self.lock:
+            self.generations[channel] = self.generations.get(channel, 0) + 1
+
+    def is_current(self, channel, generation):
+        """True while no newer request has been submitted, or the channel canceled, since this generation."""
+        return self.generations.get(channel) == generation
+
+    def post(self, channel, generation, callback, *args):
+        """Schedule callback(*args) on the Tk main loop, dropped if the request has been superseded."""
+        self.results.put((channel, generation, callback, args))
+
+    def drain_results(self):
+        """Run the posted callbacks of current requests, must be called from the Tk main loop."""
+        while True:
+            try:
+                channel, generation, callback, args = self.results.get_nowait()
+            except queue.Empty:
+                return
+            if self.is_current(channel, generation):
+                callback(*args)
+
+    def stop(self):
+        """Stop the worker thread after the request it is running."""
+        self.requests.put(None)
+
+    def run_pending(self, deferred_channels):
+        """
+        Run the requests waiting in the queue, on the worker thread from inside a running request.
+        Requests on deferred_channels (including the running request's own) stay queued in order.
+        """
+        deferred = []
+        while True:
+            try:
+                request = self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is None or request[0] in deferred_channels:
+                deferred.append(request)
+            else:
+                self._execute(request)
+        for request in deferred:
+            self.requests.put(request)
+
+    def _execute(self, request):
+        channel, generation, func, args = request
+        if not self.is_current(channel, generation):
+            return  # Superseded while waiting in the queue
+        try:
+            func(generation, *args)
+        except Exception as e:
+            print(f"Error in {channel} request: {e}")
+            if self.on_error:
+                self.post(channel, generation, self.on_error, channel, str(e))
+
+    def _run(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            self._execute(request)
+
 # GUI Application Class
 class TonightSkyApp:
     def __init__(self, root):
         self.root = root
         self.root.title("TonightSky Object Transit Calculator (v2.0)")
-        # Initialize the abort flag
-        self.abort_flag = threading.Event()
+        # Single background worker for searches, results come back through its queue
+        self.worker = ComputeWorker(on_error=self.on_worker_error)
+        self.timezone_finder = None  # Created on the worker thread by the first search
 
         # Load saved settings (including filters)
         self.settings = load_settings()
 
+        # Disk cache of previous search results
+        self.result_cache = ResultCache()
+
+        # IERS tables, offline unless auto-download is enabled, loaded by the warm-up on the worker
+        self.ephemeris = EphemerisDataManager(auto_download=self.settings.get("iers_auto_download", False))
+
          # Set initial window size
         window_width = 1300
         window_height = 1000
@@ -487,12 +2353,52 @@ class TonightSkyApp:
         self.list_button = tk.Button(root, text="List Objects", command=self.toggle_search, width=12)
         self.list_button.grid(row=4, column=2, sticky="w")
 
+        # Plan Night button, schedules the listed objects across tonight's dark time,
+        # and Multi-Site button, evaluates the search at several observing sites
+        tools_frame = tk.Frame(root)
+        tools_frame.grid(row=4, column=3, sticky="w")
+        self.plan_button = tk.Button(tools_frame, text="Plan Night", command=self.open_plan_window, width=12)
+        self.plan_button.pack(side=tk.LEFT)
+        self.multi_site_button = tk.Button(tools_frame, text="Multi-Site", command=self.open_multi_site_window, width=12)
+        self.multi_site_button.pack(side=tk.LEFT)
+        self.export_button = tk.Button(tools_frame, text="Export", command=self.open_export_window, width=12)
+        self.export_button.pack(side=tk.LEFT)
+        self.best_dates_button = tk.Button(tools_frame, text="Best Dates", command=self.open_best_dates_window, width=12)
+        self.best_dates_button.pack(side=tk.LEFT)
+        tk.Button(tools_frame, text="Clear Cache", command=self.clear_result_cache, width=12).pack(side=tk.LEFT)
+
         # Sidereal Time label and value
         tk.Label(root, text="Sidereal Time:").grid(row=3, column=2, padx=5, sticky="w")
         self.sidereal_value_label = tk.Label(root, text="")  # Value label for sidereal time
         self.sidereal_value_label.grid(row=3, column=3, sticky="w")
         self.initialize_sidereal_time()
 
+        # Moon label and value, updated by each search
+        tk.Label(root, text="Moon:").grid(row=2, column=2, padx=5, sticky="w")
+        self.moon_value_label = tk.Label(root, text="")
+        self.moon_value_label.grid(row=2, column=3, sticky="w")
+
+        # Quick find, lists the objects whose name or alternate name contains the text as you type
+        tk.Label(root, text="Find:").grid(row=1, column=2, padx=5, sticky="w")
+        self.quick_find_combobox = ttk.Combobox(root, width=50)
+        self.quick_find_combobox.grid(row=1, column=3, sticky="w")
+        self.quick_find_combobox.bind("<KeyRelease>", self.schedule_quick_find)
+        self.quick_find_combobox.bind("<<ComboboxSelected>>", self.show_quick_find_match)
+        self.quick_find_combobox.bind("<Return>", self.show_quick_find_match)
+        self.quick_find_matches = []
+        self.quick_find_after_id = None
+
+        # IERS data age, import of a newer table and the auto-download option
+        tk.Label(root, text="IERS Data:").grid(row=5, column=2, padx=5, sticky="w")
+        ephemeris_frame = tk.Frame(root)
+        ephemeris_frame.grid(row=5, column=3, sticky="w")
+        self.ephemeris_label = tk.Label(ephemeris_frame, text=self.ephemeris.describe())
+        self.ephemeris_label.pack(side=tk.LEFT)
+        tk.Button(ephemeris_frame, text="Import...", command=self.import_iers_table).pack(side=tk.LEFT, padx=5)
+        self.iers_auto_download_var = tk.BooleanVar(value=self.ephemeris.auto_download)
+        tk.Checkbutton(ephemeris_frame, text="Auto-download", variable=self.iers_auto_download_var,
+                       command=self.toggle_iers_auto_download).pack(side=tk.LEFT)
+
         # Bind events to recalculate Sidereal Time
         self.lat_entry.bind("<KeyRelease>", self.update_sidereal_time)
         self.lon_entry.bind("<KeyRelease>", self.update_sidereal_time)
@@ -531,12 +2437,14 @@ class TonightSkyApp:
         self.query_text.bind("<Control-Return>", lambda event: self.list_objects())
 
         # Treeview for displaying objects
-        columns = ("Name", "RA", "Dec", "Transit Time", "Relative TT", "Before/After", "Altitude", "Azimuth", "Alt Name", "Type", "Magnitude", "Info", "Catalog")
+        columns = ResultSet.columns
         tree_frame = tk.Frame(root)
         tree_frame.grid(row=10, column=0, columnspan=7, sticky="nsew", pady=(5, 5))
         self.tree = ttk.Treeview(tree_frame, columns=columns, show="headings")
         tree_scrollbar = ttk.Scrollbar(tree_frame, orient="vertical", command=self.tree.yview)
-        self.tree.configure(yscrollcommand=tree_scrollbar.set)
+        tree_xscrollbar = ttk.Scrollbar(tree_frame, orient="horizontal", command=self.tree.xview)
+        self.tree.configure(yscrollcommand=tree_scrollbar.set, xscrollcommand=tree_xscrollbar.set)
+        tree_xscrollbar.pack(side=tk.BOTTOM, fill=tk.X)
         self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         tree_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         for col in columns:
@@ -555,6 +2463,17 @@ class TonightSkyApp:
 
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
         self.figure = None
+        self.results = None
+        self.last_search = None
+
+        # Drain worker results on the Tk main loop
+        self.poll_worker_results()
+
+        # Pick up edits of the catalog CSV while the app is open
+        self.watch_catalog_files()
+
+        # Load the IERS tables, catalog and timezone data on the worker so the first search is not slowed by them
+        self.worker.submit("warmup", self.warm_up_in_background, self.get_csv_path(), self.lat_entry.get(), self.lon_entry.get())
 
 
     def get_csv_path(self):
@@ -585,10 +2504,10 @@ class TonightSkyApp:
 
     # Sorting column function
     def sort_column(self, col, reverse):
-        data = [(self.tree.set(k, col), k) for k in self.tree.get_children('')]
-        data.sort(reverse=reverse)
-        for index, (_, k) in enumerate(data):
-            self.tree.move(k, '', index)
+        # Sort on the raw values in the result set, numbers by value and times chronologically
+        if self.results:
+            for index, i in enumerate(self.results.sort_order(col, reverse)):
+                self.tree.move(str(i), '', index)
         self.tree.heading(col, command=lambda: self.sort_column(col, not reverse))
 
 
@@ -597,21 +2516,37 @@ class TonightSkyApp:
         """Toggle between starting and canceling the search."""
         if self.list_button.cget("text") == "List Objects":
             # Start search
-            self.abort_flag.clear()
-            self.list_button.config(text="Cancel")
             self.list_objects()
         else:
             # Cancel search
-            self.abort_flag.set()
-            self.list_button.config(text="List Objects")
+            self.cancel_search()
             self.update_status("Search canceled")
 
     def cancel_search(self):
-        """Signal the search to abort."""
-        self.abort_flag.set()  # Set the abort flag to True
+        """Supersede the running search so it stops and its results are discarded."""
+        self.worker.cancel("search")
         self.update_status("Cancelling search...")
         self.list_button.config(text="List Objects", state=tk.NORMAL)  # Restore the button text and functionality
 
+    def on_worker_error(self, channel, message):
+        """Report a failed worker request in the status label."""
+        if channel == "search":
+            self.restore_list_button()
+        elif channel == "export":
+            self.restore_export_button()
+        self.update_status(f"Error: {message}")
+
+    def poll_worker_results(self):
+        """Apply results posted by the compute worker, then check again shortly."""
+        try:
+            self.worker.drain_results()
+        finally:
+            self.root.after(50, self.poll_worker_results)
+
+    def restore_export_button(self):
+        """Restore the Export button after an export finishes, fails or is canceled."""
+        self.export_button.config(text="Export", command=self.open_export_window)
+
     def restore_list_button(self):
         """Restore the List Objects button to its default state."""
         
@@ -625,173 +2560,326 @@ class TonightSkyApp:
         # Remove focus from the query text field and set it on the Treeview
         self.tree.focus_set()
 
+        # Parse the query conditions, if any
+        conditions = self.parse_query()
+        if conditions is None:
+            self.list_button.config(text="List Objects", state=tk.NORMAL)
+            return
+        # Get the CSV file path
+        file_path = self.get_csv_path()
+
+        # Snapshot the inputs on the main thread, the worker never reads Tk widgets
+        search_input = {
+            "latitude": self.lat_entry.get(),
+            "longitude": self.lon_entry.get(),
+            "date": self.date_entry.get(),
+            "local_time": self.time_entry.get(),
+            "filters": [key for key, var in self.catalog_vars.items() if var.get()],
+            "season": self.season_settings()
+        }
+
+        # Queue the search on the compute worker, superseding any search still running
+        self.list_button.config(text="Cancel")
+        self.update_status("Loading...")
+        self.worker.submit("search", self.load_objects_in_background, file_path, conditions, search_input)
+
+    def parse_query(self):
+        """Parse the filter text box into conditions, or show the error and return None."""
         # Get the current query from the text box
         query = self.query_text.get("1.0", tk.END).strip()  # Read the entered query from the edit control
 
         # Get valid column names from the Treeview (in lowercase for case-insensitive comparison)
         valid_columns = {col.lower(): col for col in self.tree["columns"]}
 
-        # Parse the query conditions, if any
         try:
-            conditions = parse_query_conditions(query, valid_columns) if query else []
+            return parse_query_conditions(query, valid_columns) if query else []
         except ValueError as e:
             self.update_status(f"Error: {e}")  # Display parsing error in the status label
-            self.list_button.config(state=tk.NORMAL)
-            return
-            # Get the CSV file path
-        file_path = self.get_csv_path()
+            return None
 
+    def load_objects_in_background(self, generation, file_path, conditions, search_input):
+        """Load objects on the compute worker, apply parsed conditions, and post progress and results to the UI."""
+        def post(callback, *args):
+            self.worker.post("search", generation, callback, *args)
 
-        # Start the worker thread to load objects in the background, passing the parsed conditions
-        thread = threading.Thread(target=self.load_objects_in_background, args=(file_path, conditions,))
-        thread.start()
-    
+        def is_cancelled():
+            return not self.worker.is_current("search", generation)
+
+        def search_failed(message):
+            self.restore_list_button()
+            self.update_status(message)
 
-    def load_objects_in_background(self, file_path, conditions):
-        """Load objects in a background thread, apply parsed conditions, and update the progress."""
         # Get user input values
-        latitude = float(self.lat_entry.get())
-        longitude = float(self.lon_entry.get())
-        local_time_str = self.time_entry.get()
+        try:
+            latitude = float(search_input["latitude"])
+            longitude = float(search_input["longitude"])
+        except ValueError:
+            post(search_failed, "Invalid Latitude or Longitude")
+            return
+        local_time_str = search_input["local_time"]
 
         # Determine local timezone based on latitude and longitude using TimezoneFinder
-        tf = TimezoneFinder()
-        timezone_str = tf.timezone_at(lat=latitude, lng=longitude)
+        if self.timezone_finder is None:
+            self.timezone_finder = TimezoneFinder()
+        timezone_str = self.timezone_finder.timezone_at(lat=latitude, lng=longitude)
 
         if timezone_str:
             timezone = pytz.timezone(timezone_str)
             # Update the combobox with the found timezone
-            self.timezone_combobox.set(timezone_str)
+            post(self.timezone_combobox.set, timezone_str)
         else:
-            self.update_status("Timezone not found for the given coordinates")
-            self.list_button.config(state=tk.NORMAL)
+            post(search_failed, "Timezone not found for the given coordinates")
             return
 
         # Convert input local time and date to a datetime object using the found timezone
         try:
-            today_str = self.date_entry.get()
+            today_str = search_input["date"]
             local_date_time = f"{today_str} {local_time_str}"  # Combine date and time
             local_time = timezone.localize(datetime.strptime(local_date_time, "%Y-%m-%d %H:%M"))
         except ValueError:
-            self.update_status("Invalid Date or Time format")
-            self.list_button.config(state=tk.NORMAL)
+            post(search_failed, "Invalid Date or Time format")
             return
 
         # Get selected catalogs for filtering
-        filters = [key for key, var in self.catalog_vars.items() if var.get()]
-
-        # Update the status label to show "Loading..."
-        self.status_label.config(text="Loading...")
-        self.root.update_idletasks()  # Ensure immediate UI update
+        filters = search_input["filters"]
 
         # Function to update the progress
         def update_progress(progress_percentage):
-            self.root.after(0, lambda: self.status_label.config(text=f"Loading... {progress_percentage}%"))
-
-        # Load the objects (in the background thread), applying conditions and updating progress
-        objects = self.list_objects_near_transit(file_path, latitude, longitude, local_time, filters, conditions, progress_callback=update_progress)
+            post(self.update_status, f"Loading... {progress_percentage}%")
+
+        # Return a previous result for the same site, minute, catalogs and query straight from the cache
+        season = search_input["season"]
+        cache_key = self.result_cache.make_key(file_path, latitude, longitude, local_time, filters, conditions, season)
+        results = self.result_cache.get(cache_key, load_catalog(file_path))
+        status = "Search complete (cached)"
+
+        # The Moon's position and phase are computed once per search instant
+        moon = calculate_moon_position(latitude, longitude, local_time)
+        post(self.update_moon_label, moon)
+
+        if results is None:
+            # Load the objects (on the worker), applying conditions and updating progress
+            results = self.list_objects_near_transit(file_path, latitude, longitude, local_time, filters, conditions, moon=moon,
+                                                     progress_callback=update_progress, is_cancelled=is_cancelled, season=season)
+            status = "Search complete"
+            # Only complete searches are cached, a superseded search holds partial results
+            if is_cancelled():
+                return
+            self.result_cache.put(cache_key, results)
 
         # Update the Treeview with the loaded objects (back on the main thread)
-        self.root.after(0, lambda: self.update_treeview(objects))
-
-        # Once done, update status to "Search complete" and enable the List button and query edit box
-        self.root.after(0, lambda: self.status_label.config(text="Search complete"))
-        self.root.after(0, lambda: self.query_text.config(state=tk.NORMAL))  # Re-enable the query text box
-        # Restore the List Objects button and status after completion
-        self.root.after(0, lambda: self.restore_list_button())
+        search = {"file_path": file_path, "latitude": latitude, "longitude": longitude, "local_time": local_time, "filters": filters,
+                  "season": season}
+        post(self.update_treeview, results, search)
 
-    def update_status(self, message):
-        """Update the status label at the bottom of the window."""
-        self.status_label.config(text=message)
+        # Restore the List Objects button, then show the search status
+        post(self.restore_list_button)
+        post(self.update_status, status)
 
-    def list_objects_near_transit(self, file_path, latitude, longitude, local_time, filters, conditions, progress_callback=None):
+    def schedule_quick_find(self, event=None):
+        """Look up the quick find text shortly after the last key press."""
+        if event is not None and event.keysym in ("Up", "Down", "Return", "Escape", "Tab"):
+            return
+        if self.quick_find_after_id is not None:
+            self.root.after_cancel(self.quick_find_after_id)
+        self.quick_find_after_id = self.root.after(150, self.start_quick_find)
+
+    def start_quick_find(self):
+        """Queue the quick find lookup on the compute worker, the first lookup loads and indexes the catalog."""
+        self.quick_find_after_id = None
+        self.worker.submit("find", self.quick_find_in_background, self.get_csv_path(), self.quick_find_combobox.get())
+
+    def quick_find_in_background(self, generation, file_path, text):
+        """Find the objects matching the quick find text on the worker and post them to the combobox."""
+        catalog = load_catalog(file_path)
+        rows = catalog.quick_find(text)
+        matches = [(catalog.text("Name", row), catalog.text("Alt Name", row), catalog.text("Catalog", row)) for row in rows]
+        self.worker.post("find", generation, self.update_quick_find, matches)
+
+    def update_quick_find(self, matches):
+        """Show the quick find matches in the combobox drop down."""
+        self.quick_find_matches = matches
+        self.quick_find_combobox["values"] = [f"{' '.join(name.split())}  {alt_name}  ({catalog})" for name, alt_name, catalog in matches]
+
+    def show_quick_find_match(self, event=None):
         """
-        Load objects from CSV file, calculate their transit times and alt/az, and apply query conditions.
-        Updates progress after evaluating each row.
+        Select the chosen quick find match in the results, or when it is not listed search for it by name.
+        Return takes the first match unless one was picked from the drop down.
         """
-        objects = []
-
-        with open(file_path, mode='r', encoding='ISO-8859-1') as file:
-            reader = csv.DictReader(file)
-            total_rows = sum(1 for _ in file) - 1  # Total number of rows, excluding header
-            file.seek(0)  # Reset file pointer to the beginning after counting rows
-            processed_rows = 0
-
-            # Convert local time to UTC and calculate Local Sidereal Time (LST)
-            utc_time = local_time.astimezone(pytz.utc)
-            lst = calculate_lst(longitude, utc_time)
-
-            for row in reader:
-                # Check for abort signal
-                if self.abort_flag.is_set():
-                    break  # Exit the loop if the user cancels the search
-
-                # Update progress regardless of whether the row passed or failed the conditions
-                processed_rows += 1
-                if processed_rows % 100 == 0:
-                    progress_percentage = int((processed_rows / total_rows) * 100)
-                    if progress_callback:
-                        progress_callback(progress_percentage)
-
-                catalog = row['Catalog'].strip()
-                if filters and catalog not in filters:
-                    continue
-
-                try:
-                    ra = float(row['RA'])  # Assuming RA is in hours
-                    dec = float(row['Dec'])  # Assuming Dec is in degrees
-                except ValueError:
-                    continue  # Skip rows with invalid RA/Dec values
-
-                # Step 1: Compute values like transit time, altitude, and azimuth
-                #transit_time_minutes, before_after, altitude, azimuth = calculate_transit_and_alt_az(ra, dec, latitude, longitude, local_time)
-                transit_time_minutes, local_transit_time, before_after, altitude, azimuth = calculate_transit_and_alt_az(ra, dec, latitude, longitude, local_time)
-
-                # Skip objects with negative altitude (below horizon)
-                if altitude < 0:
-                    continue
+        if not self.quick_find_matches:
+            return
+        index = self.quick_find_combobox.current()
+        name, _, catalog = self.quick_find_matches[index if index >= 0 else 0]
+
+        if self.results:
+            for i, row in enumerate(self.results.data['row'].tolist()):
+                if self.results.catalog.text("Name", row) == name and self.results.catalog.text("Catalog", row) == catalog:
+                    self.tree.selection_set(str(i))
+                    self.tree.see(str(i))
+                    return
+
+        # Not in the current results, list it on its own
+        quote = '"' if "'" in name else "'"
+        self.query_text.delete("1.0", tk.END)
+        self.query_text.insert(tk.END, f"name = {quote}{name}{quote}")
+        self.list_objects()
+
+    def warm_up_in_background(self, generation, file_path, latitude, longitude):
+        """Load the data every search needs on the compute worker, then show the IERS data age and sidereal time."""
+        try:
+            latitude, longitude = float(latitude), float(longitude)
+        except ValueError:
+            latitude, longitude = 0.0, 0.0
+        # The timezone a search at the site would use, its twilight tables follow local nights
+        if self.timezone_finder is None:
+            self.timezone_finder = TimezoneFinder()
+        timezone_str = self.timezone_finder.timezone_at(lat=latitude, lng=longitude) or 'UTC'
+        self.ephemeris.warm_up(latitude, longitude, timezone_str)
+        self.worker.post("warmup", generation, self.update_ephemeris_label)
+        self.worker.post("warmup", generation, self.update_sidereal_time)
+
+        load_catalog(file_path)
+
+    def watch_catalog_files(self):
+        """Check the catalogs in memory for edits of their CSV every two seconds, applying them on the compute worker."""
+        try:
+            modified = modified_catalogs()
+            if modified:
+                self.worker.submit("catalog", self.update_catalogs_in_background, modified)
+        finally:
+            self.root.after(2000, self.watch_catalog_files)
+
+    def update_catalogs_in_background(self, generation, file_paths):
+        """Apply the edits of the catalog CSVs on the compute worker, between searches."""
+        for file_path in file_paths:
+            catalog, changes = update_catalog(file_path)
+            self.worker.post("catalog", generation, self.catalog_updated, file_path, changes)
+
+    def catalog_updated(self, file_path, changes):
+        """Report an edited catalog CSV, the listed results may no longer match it."""
+        if changes is None:
+            summary = "reloaded"
+        elif any(changes.values()):
+            summary = f"{changes['changed']} changed, {changes['added']} added, {changes['removed']} removed"
+        else:
+            return  # Saved without changes
+        stale = ", results may be stale, List Objects to refresh" if self.results else ""
+        self.update_status(f"Catalog {os.path.basename(file_path)} updated: {summary}{stale}")
+
+    def update_ephemeris_label(self):
+        """Show which IERS table is in use and how old its measurements are."""
+        self.ephemeris_label.config(text=self.ephemeris.describe())
+
+    def import_iers_table(self):
+        """Import a newer finals2000A IERS-A file chosen by the user, read and validated on the worker."""
+        file_path = filedialog.askopenfilename(
+            title="Select an IERS-A finals2000A file",
+            filetypes=(("IERS-A Files", "finals2000A.* finals.*"), ("All Files", "*.*"))
+        )
+        if not file_path:
+            return
 
+        def import_table(generation):
+            self.ephemeris.import_table(file_path)
+            self.worker.post("ephemeris", generation, self.update_ephemeris_label)
+            self.worker.post("ephemeris", generation, self.update_status, "IERS table imported")
 
-                # Step 2: Build the complete row object (from both CSV and computed values)
-                current_row = {
-                    'Name': row['Name'],
-                    'RA': degrees_to_ra(float(row['RA'])),
-                    'Dec': format_dec(dec),
-                    'Transit Time': local_transit_time,
-                    'Relative TT': format_transit_time(transit_time_minutes),
-                    'Before/After': before_after,
-                    'Altitude': f"{altitude:.2f}°",
-                    'Azimuth': f"{azimuth:.2f}°",
-                    'Alt Name': row['Alt Name'],
-                    'Type': row['Type'],
-                    'Magnitude': row['Magnitude'],
-                    'Info': row['Info'],
-                    'Catalog': row['Catalog']
-                }
+        self.update_status("Importing IERS table...")
+        self.worker.submit("ephemeris", import_table)
 
+    def clear_result_cache(self):
+        """Remove the cached search results, on the worker so no search is writing to the cache meanwhile."""
+        def clear(generation):
+            self.result_cache.clear()
+            self.worker.post("cache", generation, self.update_status, "Result cache cleared")
 
-                # Step 3: Evaluate conditions on the fully built row object
-                if evaluate_conditions(current_row, conditions):
-                    # Append the object details to the final list if the conditions are met
-                    objects.append(current_row)
+        self.worker.submit("cache", clear)
 
+    def toggle_iers_auto_download(self):
+        """Apply the IERS auto-download checkbox and keep it in the settings."""
+        self.ephemeris.set_auto_download(self.iers_auto_download_var.get())
+        self.update_ephemeris_label()
+        self.save_settings()
 
-        return objects
+    def update_status(self, message):
+        """Update the status label at the bottom of the window."""
+        self.status_label.config(text=message)
 
+    def update_moon_label(self, moon):
+        """Show the Moon's altitude, azimuth and illuminated fraction for the search time."""
+        _, _, altitude, azimuth, illumination = moon
+        self.moon_value_label.config(text=f"Alt {altitude:.1f}°  Az {azimuth:.1f}°  {illumination * 100:.0f}% illuminated")
 
-    def update_treeview(self, objects):
+    def list_objects_near_transit(self, file_path, latitude, longitude, local_time, filters, conditions, moon=None, progress_callback=None, is_cancelled=None,
+                                  season=default_season):
+        """
+        Calculate transit times, alt/az and Moon separation for every candidate in the columnar
+        catalog at once, then apply query conditions to the whole result set. The best dates and
+        season of the year ahead are only calculated for the rows the other conditions keep.
+        Returns a ResultSet, updates progress after each stage.
+        """
+        catalog = load_catalog(file_path)
+        # Name, type, description and 'within' conditions are answered by the indexes before any astronomy
+        candidates, conditions = catalog.apply_index_conditions(catalog.select(filters), conditions)
+        if progress_callback:
+            progress_callback(10)
+
+        # Step 1: Compute transit time, altitude and azimuth for every candidate in one transform
+        ra, dec = catalog.ra[candidates], catalog.dec[candidates]
+        time_diff_hours, altitude, azimuth = calculate_transit_and_alt_az_array(ra, dec, latitude, longitude, local_time)
+
+        data = build_result_data(candidates, ra, dec, time_diff_hours, altitude, azimuth)
+        if progress_callback:
+            progress_callback(30)
+        if is_cancelled and is_cancelled():
+            return ResultSet(catalog, data[:0], local_time, 0.0)
+
+        # Step 2: Separation from the Moon now and its minimum over the night's dark window
+        if moon is None:
+            moon = calculate_moon_position(latitude, longitude, local_time)
+        moon_ra, moon_dec, _, _, moon_illum = moon
+        data['moon_sep'] = angular_separation_deg(data['ra'], data['dec'], moon_ra, moon_dec)
+
+        night_date = night_start_date(local_time)
+        try:
+            dusk_time, dawn_time = calculate_astronomical_dusk_dawn(latitude, longitude, night_date, local_time.tzinfo.zone)
+            data['min_moon_sep'] = calculate_min_moon_separation(data['ra'], data['dec'], latitude, longitude, dusk_time, dawn_time)
+        except (ValueError, AttributeError):
+            data['min_moon_sep'] = np.nan  # No astronomical darkness on this night at this latitude
+        if progress_callback:
+            progress_callback(60)
+
+        # Step 3: Evaluate conditions on the whole result set
+        results = ResultSet(catalog, data, local_time, moon_illum)
+        if is_cancelled and is_cancelled():
+            return results.subset(slice(0, 0))
+        season_conditions = [condition for condition in conditions if condition[0] in ResultSet.season_columns]
+        conditions = [condition for condition in conditions if condition[0] not in ResultSet.season_columns]
+        results = results.subset(evaluate_conditions_array(results, conditions))
+        if progress_callback:
+            progress_callback(80)
+
+        # Step 4: Best dates over the coming year for the rows left, then the conditions on them
+        fill_best_dates(results.data, latitude, longitude, local_time, season)
+        results = results.subset(evaluate_conditions_array(results, season_conditions))
+        if progress_callback:
+            progress_callback(100)
+
+        return results
+
+
+    def update_treeview(self, results, search=None):
         """Update the Treeview with the loaded celestial objects."""
+        # Keep the result set and the search it came from, every consumer reads from the result set
+        self.results = results
+        self.last_search = search
+
         # Clear the treeview
-        for item in self.tree.get_children():
-            self.tree.delete(item)
+        self.tree.delete(*self.tree.get_children())
 
-        # Populate the treeview with the filtered objects
-        for obj in objects:
-            self.tree.insert("", "end", values=(obj['Name'], obj['RA'], obj['Dec'],
-                                                obj['Transit Time'], obj['Relative TT'], 
-                                                obj['Before/After'], obj['Altitude'], obj['Azimuth'], 
-                                                obj['Alt Name'], obj['Type'], obj['Magnitude'], 
-                                                obj['Info'], obj['Catalog']))
+        # Populate the treeview, the item id is the row number in the result set
+        for i, values in enumerate(results.rows(self.tree["columns"])):
+            self.tree.insert("", "end", iid=str(i), values=values)
 
         # Enable the list button again and update status
         self.list_button.config(state=tk.NORMAL)
@@ -808,7 +2896,12 @@ class TonightSkyApp:
             "timezone": self.timezone_combobox.get(),
             "filter_expression": self.query_text.get("1.0", tk.END).strip(),
             "catalogs": {catalog: var.get() for catalog, var in self.catalog_vars.items()},
-            "csv_file_path": self.csv_path_entry.get()  # Save the CSV file path
+            "csv_file_path": self.csv_path_entry.get(),  # Save the CSV file path
+            "target_priorities": self.settings.get("target_priorities", {}),
+            "plan": self.settings.get("plan", {}),
+            "sites": self.settings.get("sites", []),
+            "iers_auto_download": self.iers_auto_download_var.get(),
+            "best_dates": self.settings.get("best_dates", {})
         }
         save_settings(settings)
 
@@ -818,6 +2911,9 @@ class TonightSkyApp:
         
     def initialize_sidereal_time(self):
         """Initialize Sidereal Time based on the current input values."""
+        if not self.ephemeris.is_loaded:
+            self.sidereal_value_label.config(text="Loading...")  # Shown once the warm-up has loaded the IERS tables
+            return
         try:
             longitude = float(self.lon_entry.get())
             local_time_str = self.time_entry.get()
@@ -839,20 +2935,21 @@ class TonightSkyApp:
 
     def copy_to_clipboard(self):
         """Copy the content of the selected item in the Treeview to the clipboard."""
-        selected_item = self.tree.selection()
-        if selected_item:
-            item = self.tree.item(selected_item)
-            item_values = item['values']
-
-            headers = ["Name", "RA", "Dec", "Transit Time", "Before/After", "Altitude", "Azimuth", "Alt Name", "Type", "Magnitude", "Info", "Catalog"]
+        rows = self.selected_rows()
+        if rows:
+            headers = self.tree["columns"]
             formatted_text = '\t'.join(headers) + '\n'
-            formatted_text += '\t'.join(map(str, item_values))
+            formatted_text += '\t'.join(self.results.values(rows[0], headers))
 
             self.root.clipboard_clear()
             self.root.clipboard_append(formatted_text)
 
             self.status_label.config(text="Selected item copied to clipboard!")
 
+    def selected_rows(self):
+        """Return the result set row numbers of the selected Treeview items."""
+        return [int(item) for item in self.tree.selection()] if self.results else []
+
     def bind_treeview_selection(self):
         """Bind the selection event of the Treeview to copy content to clipboard."""
         self.tree.bind("<<TreeviewSelect>>", lambda event: self.copy_to_clipboard())
@@ -866,6 +2963,13 @@ class TonightSkyApp:
         self.context_menu = tk.Menu(self.root, tearoff=0)
         self.context_menu.add_command(label="Graph", command=self.open_altitude_graph)
         self.context_menu.add_command(label="Copy", command=self.copy_to_clipboard)
+        self.context_menu.add_command(label="Export...", command=self.open_export_window)
+        self.context_menu.add_command(label="Add to Calendar...", command=lambda: self.export_best_dates_calendar(selected_only=True))
+        self.context_menu.add_command(label="Neighbors...", command=self.open_neighbors_window)
+        priority_menu = tk.Menu(self.context_menu, tearoff=0)
+        for priority in range(1, 6):
+            priority_menu.add_command(label=str(priority), command=lambda p=priority: self.set_target_priority(p))
+        self.context_menu.add_cascade(label="Plan Priority", menu=priority_menu)
         if platform.system() == 'Darwin':
             self.tree.bind("<Control-Button-1>", self.show_context_menu)
             self.tree.bind("<Button-2>", self.show_context_menu)
@@ -885,10 +2989,9 @@ class TonightSkyApp:
 
     def open_astrobin_page(self):
         """Open AstroBin search page for the selected object."""
-        selected_item = self.tree.selection()
-        if selected_item:
-            item = self.tree.item(selected_item)
-            object_name = item['values'][0]  # Extract the name of the selected object
+        rows = self.selected_rows()
+        if rows:
+            object_name = self.results.format(rows[0], "Name")  # Extract the name of the selected object
 
             # Generate the AstroBin search URL based on the object name
         # Remove spaces and encode the object name for a URL
@@ -904,55 +3007,514 @@ class TonightSkyApp:
     # Update open_altitude_graph function
     def open_altitude_graph(self):
         """Generate an altitude graph for the selected object."""
-        selected_item = self.tree.selection()
-        if selected_item:
-            item = self.tree.item(selected_item)
-            object_name = item['values'][0]
-            dec = float(item['values'][2].strip('°'))
-            latitude = float(self.lat_entry.get())
-            longitude = float(self.lon_entry.get())
-            timezone_str = self.timezone_combobox.get()
+        rows = self.selected_rows()
+        if rows and self.last_search:
+            # Exact coordinates and transit time from the result set
+            i = rows[0]
+            object_name = self.results.format(i, "Name")
+            ra, dec = float(self.results.data['ra'][i]), float(self.results.data['dec'][i])
+            transit_time = self.results.transit_time(i)
+
+            # Graph the night of the search at the searched site
+            latitude, longitude = self.last_search["latitude"], self.last_search["longitude"]
+            timezone_str = self.results.local_time.tzinfo.zone
+            night_date = night_start_date(self.results.local_time)
+
+            # The first graph of a site and year builds its twilight table, compute on the worker
+            self.worker.submit("graph", self.altitude_graph_in_background, object_name, ra, dec, transit_time,
+                               latitude, longitude, night_date, timezone_str)
+
+    def altitude_graph_in_background(self, generation, object_name, ra, dec, transit_time, latitude, longitude, night_date, timezone_str):
+        """Compute the night's twilight times and the object's altitudes on the compute worker, then plot them on the UI."""
+        # Sunset, sunrise, dusk and dawn for the night, looked up in the site's twilight table
+        try:
+            sunset, sunrise = calculate_sunset_sunrise(latitude, longitude, night_date, timezone_str)
+            dusk_time, dawn_time = calculate_astronomical_dusk_dawn(latitude, longitude, night_date, timezone_str)
+            # Generate altitude data using dusk and dawn times
+            altitude_data = generate_altitude_data(ra, dec, latitude, longitude, night_date, timezone_str, sunset, sunrise)
+        except (ValueError, IndexError) as e:
+            # No night to graph, e.g. under the midnight sun, or no Earth orientation data for the date
+            self.worker.post("graph", generation, self.update_status, f"Error: {e}")
+            return
 
-            # Extract hours, minutes, and seconds from the RA string
-            ra_parts = item['values'][1].split(':')
-            ra_hours = float(ra_parts[0])
-            ra_minutes = float(ra_parts[1])
-            ra_seconds = float(ra_parts[2]) if len(ra_parts) > 2 else 0.0
+        # Call the plot function
+        self.worker.post("graph", generation, plot_altitude_graph, object_name, altitude_data, transit_time, dusk_time, dawn_time)
 
-            # Convert RA to degrees, including minutes and seconds
-            ra = (ra_hours + ra_minutes / 60 + ra_seconds / 3600) * 15
+    neighbor_columns = ("Name", "Alt Name", "Type", "Magnitude", "Separation", "Catalog")
 
-            # Extract and parse the transit time (already in local time)
-            transit_time_str = item['values'][3]
+    def open_neighbors_window(self):
+        """List the catalog objects within a cone or a camera field of view around the selected object."""
+        rows = self.selected_rows()
+        if not rows:
+            self.update_status("Select an object to list its neighbors")
+            return
+        catalog = self.results.catalog
+        i = rows[0]
+        name = self.results.format(i, "Name").strip()
+        ra, dec = float(self.results.data['ra'][i]), float(self.results.data['dec'][i])
+
+        window = tk.Toplevel(self.root)
+        window.title(f"Neighbors of {name}")
+        window.geometry("800x450")
+
+        # Search shape, a cone of a radius or a field of view of a width, height and position angle
+        options = tk.Frame(window)
+        options.pack(side=tk.TOP, fill=tk.X, padx=5, pady=5)
+        neighbor_settings = self.settings.get("neighbors", {})
+        shape = tk.StringVar(value=neighbor_settings.get("shape", "cone"))
+        entries = {}
+        for key, label, default in (("radius", "Radius (°):", 1.0), ("width", "Width (°):", 2.0),
+                                    ("height", "Height (°):", 1.5), ("angle", "Angle (°):", 0.0)):
+            if key in ("radius", "width"):
+                tk.Radiobutton(options, text="Cone" if key == "radius" else "Field", variable=shape,
+                               value="cone" if key == "radius" else "field").pack(side=tk.LEFT)
+            tk.Label(options, text=label).pack(side=tk.LEFT)
+            entries[key] = tk.Entry(options, width=6)
+            entries[key].insert(0, f"{neighbor_settings.get(key, default):g}")
+            entries[key].pack(side=tk.LEFT, padx=(0, 10))
+
+        neighbor_tree = ttk.Treeview(window, columns=self.neighbor_columns, show="headings")
+        for col in self.neighbor_columns:
+            neighbor_tree.heading(col, text=col)
+            neighbor_tree.column(col, width=110, minwidth=60)
+        neighbor_tree.pack(side=tk.TOP, fill=tk.BOTH, expand=True, padx=5)
+        neighbor_status = tk.Label(window, text="", anchor="w")
+        neighbor_status.pack(side=tk.BOTTOM, fill=tk.X, padx=5)
+
+        def find_neighbors():
             try:
-                transit_time = datetime.strptime(transit_time_str, "%H:%M:%S")
+                values = {key: float(entry.get()) for key, entry in entries.items()}
             except ValueError:
-                transit_time = datetime.strptime(transit_time_str, "%H:%M")
+                neighbor_status.config(text="Invalid radius or field of view")
+                return
+            self.settings["neighbors"] = dict(values, shape=shape.get())
+            self.save_settings()
+            if shape.get() == "cone":
+                found, separation = catalog.sky_index.cone(ra, dec, values["radius"])
+            else:
+                found, separation = catalog.sky_index.field(ra, dec, values["width"], values["height"], values["angle"])
+            for item in neighbor_tree.get_children():
+                neighbor_tree.delete(item)
+            text = {column: catalog.text_array(column, found) for column in ("Name", "Alt Name", "Type", "Magnitude", "Catalog")}
+            for j in range(len(found)):
+                neighbor_tree.insert("", "end", values=(text["Name"][j], text["Alt Name"][j], text["Type"][j],
+                                                        text["Magnitude"][j], f"{separation[j]:.2f}°", text["Catalog"][j]))
+            neighbor_status.config(text=f"{len(found)} objects")
+
+        def filter_main_list():
+            try:
+                radius = float(entries["radius"].get())
+            except ValueError:
+                neighbor_status.config(text="Invalid radius")
+                return
+            quote = '"' if "'" in name else "'"
+            self.query_text.delete("1.0", tk.END)
+            self.query_text.insert(tk.END, f"within {radius:g} of {quote}{name}{quote}")
+            self.list_objects()
 
-            # Use the date from the date entry control
-            date_str = self.date_entry.get()
-            selected_date = datetime.strptime(date_str, "%Y-%m-%d")
+        tk.Button(options, text="Find", command=find_neighbors).pack(side=tk.LEFT)
+        tk.Button(options, text="Filter Main List", command=filter_main_list).pack(side=tk.LEFT, padx=(10, 0))
+        find_neighbors()
 
-            # Adjust date for transit time if necessary
-            day = selected_date.day + 1 if transit_time.hour < 12 else selected_date.day
-            timezone = pytz.timezone(timezone_str)
-            transit_time = timezone.localize(
-                transit_time.replace(year=selected_date.year, month=selected_date.month, day=day)
-            )
+    def set_target_priority(self, priority):
+        """Set the planning priority of the selected objects, saved with the settings."""
+        priorities = self.settings.setdefault("target_priorities", {})
+        for i in self.selected_rows():
+            priorities[self.results.format(i, "Name")] = priority
+        self.save_settings()
+        self.update_status(f"Plan priority set to {priority}")
 
-            # Calculate sunset and sunrise for the selected date
-            sunset, sunrise = calculate_sunset_sunrise(latitude, longitude, selected_date.date(), timezone_str)
-            # Generate altitude data using dusk and dawn times
-            altitude_data = generate_altitude_data(ra, dec, latitude, longitude, selected_date.date(), timezone_str, sunset, sunrise)
+    def open_plan_window(self):
+        """Open the imaging session planner for the current result set."""
+        if not self.results or not self.last_search:
+            self.update_status("List objects before planning the night")
+            return
 
-            # Calculate dusk and dawn times for the selected date
-            dusk_time, dawn_time = calculate_astronomical_dusk_dawn(latitude, longitude, selected_date.date(), timezone_str)
+        window = tk.Toplevel(self.root)
+        window.title("Imaging Session Plan")
+        window.geometry("900x500")
+
+        # Planner constraints
+        options = tk.Frame(window)
+        options.pack(side=tk.TOP, fill=tk.X, padx=5, pady=5)
+        plan_settings = self.settings.get("plan", {})
+        entries = {}
+        for key, label, default in (("min_altitude", "Min Altitude:", 30), ("min_duration_minutes", "Min Minutes:", 30),
+                                    ("max_duration_minutes", "Max Minutes:", 120), ("slot_minutes", "Slot Minutes:", 10),
+                                    ("framing_radius", "Frame Radius (°):", 0)):
+            tk.Label(options, text=label).pack(side=tk.LEFT)
+            entry = tk.Entry(options, width=6)
+            entry.insert(0, str(plan_settings.get(key, default)))
+            entry.pack(side=tk.LEFT, padx=(0, 10))
+            entries[key] = entry
+
+        plan_tree = ttk.Treeview(window, columns=plan_columns, show="headings")
+        for col in plan_columns:
+            plan_tree.heading(col, text=col)
+            plan_tree.column(col, width=90, minwidth=60)
+        plan_tree.pack(side=tk.TOP, fill=tk.BOTH, expand=True, padx=5)
+        plan_status = tk.Label(window, text="", anchor="w")
+        plan_status.pack(side=tk.BOTTOM, fill=tk.X, padx=5)
+
+        result = {"plan": [], "site": {}}
+
+        def run_plan():
+            try:
+                constraints = {key: float(entry.get()) if key == "framing_radius" else int(entry.get())
+                               for key, entry in entries.items()}
+            except ValueError:
+                plan_status.config(text="Invalid planner setting")
+                return
+            self.settings["plan"] = constraints
+            self.save_settings()
+            plan_status.config(text="Planning...")
+            # Snapshot the inputs on the main thread, the plan is computed on the worker
+            self.worker.submit("plan", self.plan_in_background, self.results, dict(self.last_search),
+                               dict(self.settings.get("target_priorities", {})), constraints, show_plan)
+
+        def show_plan(plan, site):
+            if not window.winfo_exists():
+                return  # Closed while planning
+            result["plan"], result["site"] = plan, site
+            for item in plan_tree.get_children():
+                plan_tree.delete(item)
+            for entry in plan:
+                plan_tree.insert("", "end", values=tuple(entry[col] for col in plan_columns))
+            plan_status.config(text=f"{len(plan)} targets planned between {site.get('dusk', '')} and {site.get('dawn', '')}")
+
+        def export_plan(file_type):
+            file_path = filedialog.asksaveasfilename(parent=window, defaultextension=f".{file_type}",
+                                                     filetypes=((f"{file_type.upper()} Files", f"*.{file_type}"), ("All Files", "*.*")))
+            if file_path:
+                if file_type == "csv":
+                    export_plan_csv(result["plan"], file_path)
+                else:
+                    export_plan_json(result["plan"], file_path, result["site"])
+                plan_status.config(text=f"Plan exported to {file_path}")
+
+        tk.Button(options, text="Plan", command=run_plan).pack(side=tk.LEFT)
+        tk.Button(options, text="Export CSV", command=lambda: export_plan("csv")).pack(side=tk.LEFT, padx=(10, 0))
+        tk.Button(options, text="Export JSON", command=lambda: export_plan("json")).pack(side=tk.LEFT)
+        run_plan()
+
+    def plan_in_background(self, generation, results, search, target_priorities, constraints, show_plan):
+        """Plan the session on the compute worker and post it to the plan window."""
+        plan, site = self.plan_session(results, search, target_priorities, **constraints)
+        self.worker.post("plan", generation, show_plan, plan, site)
+
+    def plan_session(self, results, search, target_priorities, min_altitude=30, min_duration_minutes=30, max_duration_minutes=120,
+                     slot_minutes=10, framing_radius=0):
+        """
+        Plan a result set over the astronomical dark window of the night it was searched for.
+        Targets get their priority from target_priorities by name (1 when unset). With a
+        framing_radius (degrees), targets that fit in one frame are planned as one target.
+        """
+        latitude, longitude, local_time = search["latitude"], search["longitude"], search["local_time"]
+        timezone_str = local_time.tzinfo.zone
+        try:
+            dusk_time, dawn_time = calculate_astronomical_dusk_dawn(latitude, longitude, night_start_date(local_time), timezone_str)
+        except (ValueError, AttributeError):
+            return [], {}  # No astronomical darkness to plan in
+
+        names = results.catalog.text_array("Name", results.data['row'])
+        priorities = [target_priorities.get(name, 1) for name in names]
+        ra, dec = results.data['ra'], results.data['dec']
+
+        # Nearby targets share a frame centred on the highest priority one
+        if framing_radius > 0:
+            groups = group_targets(ra, dec, priorities, framing_radius)
+            names = [" + ".join(" ".join(names[i].split()) for i in group) for group in groups]
+            priorities = [max(priorities[i] for i in group) for group in groups]
+            centres = [group[0] for group in groups]
+            ra, dec = ra[centres], dec[centres]
+
+        plan = plan_imaging_session(names, ra, dec, latitude, longitude, dusk_time, dawn_time,
+                                    priorities=priorities, min_altitude=min_altitude, min_duration_minutes=min_duration_minutes,
+                                    max_duration_minutes=max_duration_minutes, slot_minutes=slot_minutes)
+        site = {"latitude": latitude, "longitude": longitude, "timezone": timezone_str,
+                "dusk": dusk_time.strftime("%Y-%m-%d %H:%M"), "dawn": dawn_time.strftime("%Y-%m-%d %H:%M")}
+        return plan, site
+
+    def open_multi_site_window(self):
+        """Open the multi-site window to edit observing sites and evaluate the search at all of them."""
+        window = tk.Toplevel(self.root)
+        window.title("Multi-Site Search")
+        window.geometry("1000x600")
+        sites = self.settings.setdefault("sites", [])
+
+        # Site list
+        site_columns = ("Name", "Latitude", "Longitude", "Timezone")
+        site_tree = ttk.Treeview(window, columns=site_columns, show="headings", height=5)
+        for col in site_columns:
+            site_tree.heading(col, text=col)
+            site_tree.column(col, width=120, minwidth=80)
+        site_tree.pack(side=tk.TOP, fill=tk.X, padx=5, pady=5)
+
+        def refresh_sites():
+            site_tree.delete(*site_tree.get_children())
+            for site in sites:
+                site_tree.insert("", "end", values=tuple(site[col.lower()] for col in site_columns))
+
+        # Site editor, a blank timezone is looked up from the coordinates
+        editor = tk.Frame(window)
+        editor.pack(side=tk.TOP, fill=tk.X, padx=5)
+        entries = {}
+        for col in site_columns:
+            tk.Label(editor, text=f"{col}:").pack(side=tk.LEFT)
+            entry = tk.Entry(editor, width=12 if col != "Timezone" else 20)
+            entry.pack(side=tk.LEFT, padx=(0, 5))
+            entries[col.lower()] = entry
+        entries["latitude"].insert(0, self.lat_entry.get())
+        entries["longitude"].insert(0, self.lon_entry.get())
+
+        def add_site():
+            try:
+                site = {"name": entries["name"].get().strip() or f"Site {len(sites) + 1}",
+                        "latitude": float(entries["latitude"].get()),
+                        "longitude": float(entries["longitude"].get()),
+                        "timezone": entries["timezone"].get().strip()}
+            except ValueError:
+                status.config(text="Invalid site latitude or longitude")
+                return
+            if not site["timezone"]:
+                site["timezone"] = TimezoneFinder().timezone_at(lat=site["latitude"], lng=site["longitude"]) or "UTC"
+            if site["timezone"] not in pytz.all_timezones_set:
+                status.config(text=f"Unknown timezone: {site['timezone']}")
+                return
+            sites.append(site)
+            self.save_settings()
+            refresh_sites()
+
+        def remove_sites():
+            names = {site_tree.item(item)['values'][0] for item in site_tree.selection()}
+            sites[:] = [site for site in sites if site["name"] not in names]
+            self.save_settings()
+            refresh_sites()
+
+        tk.Button(editor, text="Add", command=add_site).pack(side=tk.LEFT)
+        tk.Button(editor, text="Remove", command=remove_sites).pack(side=tk.LEFT)
+
+        # Combined best site per target view
+        controls = tk.Frame(window)
+        controls.pack(side=tk.TOP, fill=tk.X, padx=5, pady=5)
+        result_tree = ttk.Treeview(window, show="headings")
+        result_scrollbar = ttk.Scrollbar(window, orient="vertical", command=result_tree.yview)
+        result_tree.configure(yscrollcommand=result_scrollbar.set)
+        result_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        result_tree.pack(side=tk.TOP, fill=tk.BOTH, expand=True, padx=5)
+        status = tk.Label(window, text="", anchor="w")
+        status.pack(side=tk.BOTTOM, fill=tk.X, padx=5)
+        site_choice = ttk.Combobox(controls, state="readonly", width=30)
+        state = {"result": None}
+
+        def show_result(multi):
+            state["result"] = multi
+            columns = ("Name", "Best Site", "Best Altitude") + tuple(f"Alt @ {site['name']}" for site in multi.sites)
+            result_tree.configure(columns=columns)
+            for col in columns:
+                result_tree.heading(col, text=col)
+                result_tree.column(col, width=110, minwidth=80)
+            result_tree.delete(*result_tree.get_children())
+            names = multi.catalog.text_array("Name", multi.rows)
+            for j, name in enumerate(names):
+                best = multi.best_site[j]
+                altitudes = tuple(f"{alt:.2f}°" if np.isfinite(alt) else "" for alt in multi.altitude[:, j])
+                result_tree.insert("", "end", values=(name, multi.sites[best]["name"], f"{multi.altitude[best, j]:.2f}°") + altitudes)
+            site_choice.configure(values=[site["name"] for site in multi.sites])
+            counts = ", ".join(f"{site['name']}: {len(results)}" for site, results in zip(multi.sites, multi.site_results))
+            status.config(text=f"{len(multi)} targets pass at one or more sites ({counts})")
+
+        def show_site_in_main_list():
+            multi = state["result"]
+            if multi is None or site_choice.current() < 0:
+                return
+            site, results = multi.sites[site_choice.current()], multi.site_results[site_choice.current()]
+            search = {"file_path": self.get_csv_path(), "latitude": site["latitude"], "longitude": site["longitude"], "local_time": results.local_time,
+                      "filters": multi.filters, "season": self.season_settings()}
+            self.update_status(f"Loading results for {site['name']}...")
+            self.worker.submit("site", self.show_site_in_background, multi, site_choice.current(), search)
+
+        def evaluate():
+            if not sites:
+                status.config(text="Add one or more sites")
+                return
+            conditions = self.parse_query()
+            if conditions is None:
+                return
+            file_path = self.get_csv_path()
+            filters = [key for key, var in self.catalog_vars.items() if var.get()]
+            status.config(text="Evaluating...")
+            self.worker.submit("multisite", self.evaluate_sites_in_background, file_path, [dict(site) for site in sites],
+                               self.date_entry.get(), self.time_entry.get(), filters, conditions, self.season_settings(), show_result, status)
+
+        tk.Button(controls, text="Evaluate", command=evaluate).pack(side=tk.LEFT)
+        tk.Label(controls, text="Site:").pack(side=tk.LEFT, padx=(20, 0))
+        site_choice.pack(side=tk.LEFT)
+        tk.Button(controls, text="Show in Main List", command=show_site_in_main_list).pack(side=tk.LEFT)
+        refresh_sites()
+
+    def show_site_in_background(self, generation, multi, s, search):
+        """Fill the best dates of a site's results on the compute worker, then list them in the main window."""
+        multi.fill_best_dates(s, search["season"])  # For the main list's season columns and calendar export
+        self.worker.post("site", generation, self.update_treeview, multi.site_results[s], search)
+        self.worker.post("site", generation, self.update_status, f"Showing results for {multi.sites[s]['name']}")
+
+    def evaluate_sites_in_background(self, generation, file_path, sites, date_str, time_str, filters, conditions, season, show_result, status):
+        """Evaluate the search at every site on the compute worker and post the combined result to the window."""
+        def is_cancelled():
+            return not self.worker.is_current("multisite", generation)
+
+        try:
+            datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M")
+        except ValueError:
+            self.worker.post("multisite", generation, lambda: status.config(text="Invalid Date or Time format"))
+            return
+
+        start = datetime.now()
+        try:
+            multi = evaluate_multi_site(file_path, sites, date_str, time_str, filters, conditions, is_cancelled=is_cancelled, season=season)
+        except ValueError as e:  # An unknown object or bad radius in a 'within' condition
+            self.worker.post("multisite", generation, lambda message: status.config(text=message), f"Error: {e}")
+            return
+        if multi is not None:
+            elapsed = (datetime.now() - start).total_seconds()
+            self.worker.post("multisite", generation, show_result, multi)
+            self.worker.post("multisite", generation, self.update_status, f"Evaluated {len(sites)} sites in {elapsed:.2f}s")
+
+    def open_export_window(self):
+        """Open the export window to stream the result set, or the whole catalog evaluation, to a file."""
+        if not self.last_search:
+            self.update_status("List objects before exporting")
+            return
+
+        window = tk.Toplevel(self.root)
+        window.title("Export")
+
+        source = tk.StringVar(value="results")
+        tk.Label(window, text="Export:").grid(row=0, column=0, sticky="w", padx=5)
+        tk.Radiobutton(window, text=f"Current results ({len(self.results) if self.results else 0} rows)", variable=source, value="results").grid(row=0, column=1, sticky="w")
+        tk.Radiobutton(window, text="Entire catalog evaluated at the searched site and time", variable=source, value="catalog").grid(row=1, column=1, sticky="w")
+
+        file_format = tk.StringVar(value="csv")
+        tk.Label(window, text="Format:").grid(row=2, column=0, sticky="w", padx=5)
+        for i, (key, label) in enumerate(export_formats.items()):
+            tk.Radiobutton(window, text=label, variable=file_format, value=key).grid(row=2 + i, column=1, sticky="w")
+
+        # Column selection
+        tk.Label(window, text="Columns:").grid(row=5, column=0, sticky="nw", padx=5)
+        columns_frame = tk.Frame(window)
+        columns_frame.grid(row=5, column=1, sticky="w")
+        column_vars = {}
+        for i, col in enumerate(ResultSet.columns):
+            column_vars[col] = tk.BooleanVar(value=True)
+            tk.Checkbutton(columns_frame, text=col, variable=column_vars[col]).grid(row=i // 4, column=i % 4, sticky="w")
+
+        def export():
+            columns = [col for col in ResultSet.columns if column_vars[col].get()]
+            if not columns:
+                self.update_status("Select one or more columns to export")
+                return
+            extension = file_format.get()
+            file_path = filedialog.asksaveasfilename(parent=window, defaultextension=f".{extension}",
+                                                     filetypes=((export_formats[extension], f"*.{extension}"), ("All Files", "*.*")))
+            if not file_path:
+                return
+            self.update_status("Exporting...")
+            self.worker.submit("export", self.export_in_background, source.get(), file_path, extension, columns,
+                               self.results, dict(self.last_search))
+            self.export_button.config(text="Cancel Export", command=self.cancel_export)  # Outlives this window
+            window.destroy()
+
+        tk.Button(window, text="Export", command=export, width=12).grid(row=6, column=0, columnspan=2, pady=5)
+
+    def season_settings(self):
+        """Minimum altitude and hours of darkness for the Season columns, from the settings."""
+        best_dates = self.settings.get("best_dates", {})
+        return (float(best_dates.get("min_altitude", default_season[0])), float(best_dates.get("min_hours", default_season[1])))
+
+    def open_best_dates_window(self):
+        """Set what a night in an object's season needs, and export the best dates of the results as a calendar."""
+        window = tk.Toplevel(self.root)
+        window.title("Best Dates")
+        min_altitude, min_hours = self.season_settings()
+
+        tk.Label(window, text="Best Date is the night each object transits at local midnight. Season is the longest run of\n"
+                              "nights in the year ahead it is above the altitude for the hours of astronomical darkness.",
+                 justify=tk.LEFT).grid(row=0, column=0, columnspan=2, sticky="w", padx=5, pady=5)
+        tk.Label(window, text="Min Altitude (°):").grid(row=1, column=0, sticky="w", padx=5)
+        altitude_entry = tk.Entry(window, width=8)
+        altitude_entry.grid(row=1, column=1, sticky="w")
+        altitude_entry.insert(0, f"{min_altitude:g}")
+        tk.Label(window, text="Dark Hours:").grid(row=2, column=0, sticky="w", padx=5)
+        hours_entry = tk.Entry(window, width=8)
+        hours_entry.grid(row=2, column=1, sticky="w")
+        hours_entry.insert(0, f"{min_hours:g}")
+        status = tk.Label(window, text="", anchor="w")
+        status.grid(row=4, column=0, columnspan=2, sticky="ew", padx=5)
+
+        def apply_season():
+            try:
+                season = {"min_altitude": float(altitude_entry.get()), "min_hours": float(hours_entry.get())}
+            except ValueError:
+                status.config(text="Invalid altitude or hours")
+                return
+            self.settings["best_dates"] = season
+            self.save_settings()
+            self.list_objects()  # Recalculate the Season columns of the results
+            window.destroy()
+
+        buttons = tk.Frame(window)
+        buttons.grid(row=3, column=0, columnspan=2, sticky="w", padx=5, pady=5)
+        tk.Button(buttons, text="Apply", command=apply_season).pack(side=tk.LEFT)
+        tk.Button(buttons, text="Export Calendar...", command=lambda: self.export_best_dates_calendar(status=status)).pack(side=tk.LEFT, padx=(10, 0))
+
+    def export_best_dates_calendar(self, selected_only=False, status=None):
+        """Write the best dates and seasons of the results, or the selected rows, to an .ics calendar file."""
+        show_status = status.config if status else self.status_label.config
+        if not self.results or not self.last_search:
+            show_status(text="List objects before exporting their best dates")
+            return
+        rows = self.selected_rows() if selected_only else None
+        file_path = filedialog.asksaveasfilename(title="Export Best Dates", defaultextension=".ics",
+                                                 filetypes=(("iCalendar Files", "*.ics"), ("All Files", "*.*")))
+        if file_path:
+            export_best_dates_ics(self.results, file_path, self.last_search["season"], rows)
+            show_status(text=f"Best dates exported to {file_path}")
+
+    def cancel_export(self):
+        """Supersede the running export, its partial file is removed."""
+        self.worker.cancel("export")
+        self.restore_export_button()
+        self.update_status("Export canceled")
+
+    def export_in_background(self, generation, source, file_path, file_format, columns, results, search):
+        """
+        Stream the export on the compute worker, posting progress to the status label. Searches,
+        finds and other requests queued meanwhile run between chunks, edits of the catalog CSV are
+        held back until the export ends so the rows it writes don't change under it.
+        """
+        def progress(percentage):
+            self.worker.post("export", generation, self.update_status, f"Exporting... {percentage}%")
+            self.worker.run_pending(("export", "catalog"))
+
+        if source == "catalog":
+            total_rows = len(load_catalog(search["file_path"]).select(search["filters"]))
+            chunks = iter_catalog_evaluation(search["file_path"], search["latitude"], search["longitude"], search["local_time"],
+                                             filters=search["filters"], season=search["season"])
+        else:
+            total_rows = len(results) if results else 0
+            chunks = iter_result_chunks(results) if results else iter(())
 
-            # Call the plot function
-            plot_altitude_graph(object_name, altitude_data, transit_time, dusk_time, dawn_time)
+        with hold_catalog_updates(search["file_path"]):
+            written = export_results(chunks, total_rows, file_path, file_format, columns, progress_callback=progress,
+                                     is_cancelled=lambda: not self.worker.is_current("export", generation))
+        if written is not None:
+            self.worker.post("export", generation, self.restore_export_button)
+            self.worker.post("export", generation, self.update_status, f"Exported {written} rows to {file_path}")
 
     def on_closing(self):
         """Close the main app and any open plot windows."""
+        self.worker.stop()
         plt.close('all')  # Close all matplotlib plot windows
         self.root.destroy()  # Close the Tkinter window
 